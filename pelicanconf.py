@@ -1,108 +1,161 @@
-#!/usr/bin/env python
-# -*- coding: utf-8 -*- #
-from dotenv import load_dotenv
-import os
-from markdown import Markdown
-
-markdown = Markdown(extensions=["markdown.extensions.extra"])
-
-
-def md(content, *args):
-    return markdown.convert(content)
-
-
-JINJA_FILTERS = {
-    "md": md,
-}
-
-load_dotenv()
-
-AUTHOR = "Sebastian Proost"
-SITENAME = "DeckLock"
-SITEURL = ""
-
-PATH = "content"
-DECKLOCK_CACHE = "dl_demo_cache"
-
-TIMEZONE = "Europe/Paris"
-
-DEFAULT_LANG = "en"
-
-THEME = "theme"
-
-# Feed generation is usually not desired when developing
-FEED_ALL_ATOM = None
-CATEGORY_FEED_ATOM = None
-TRANSLATION_FEED_ATOM = None
-AUTHOR_FEED_ATOM = None
-AUTHOR_FEED_RSS = None
-
-# We don't need any of these pages
-AUTHORS_SAVE_AS = False
-TAGS_SAVE_AS = False
-CATEGORIES_SAVE_AS = False
-ARCHIVES_SAVE_AS = False
-
-AUTHOR_SAVE_AS = False
-TAG_SAVE_AS = False
-CATEGORY_SAVE_AS = False
-
-ARTICLE_URL = "posts/{slug}/"
-ARTICLE_SAVE_AS = "posts/{slug}/index.html"
-PAGE_URL = "pages/{slug}/"
-PAGE_SAVE_AS = "pages/{slug}/index.html"
-
-# Add the assets folder to the static data
-STATIC_PATHS = ["assets"]
-
-# Configure plugins
-PLUGIN_PATHS = ["plugins"]
-PLUGINS = ["keyforge", "mtg", "gwent", "fab", "webassets", "jinja_filters"]
-
-# Welcome message, will be shown on the index page. Markdown supported
-
-WELCOME_MESSAGE = """
-#### Hi There!
-
-
-Here you can find an over view of my collection of decks across various trading card games. Click on a game below to 
-get a list of the decks I own/played! 
-
-"""
-
-# KeyForge Section
-KEYFORGE_PATH = "data"
-KEYFORGE_ASSETS_PATH = "assets/keyforge"
-
-KEYFORGE_DECK_SAVE_AS = "keyforge/{slug}.html"
-KEYFORGE_DECKS_SAVE_AS = "keyforge.html"
-
-DOK_API_KEY = os.getenv("DOK_API_KEY", None)
-
-# Magic: The Gathering Section
-MTG_PATH = "data"
-MTG_ASSETS_PATH = "assets/mtg"
-
-
-# Gwent Section
-GWENT_PATH = "data"
-GWENT_ASSETS_PATH = "assets/gwent"
-GWENT_CURRENT_VERSION = "8.2.0"
-
-# Flesh and Blood Section
-FAB_PATH = "data"
-FAB_ASSETS_PATH = "assets/fab"
-
-TEMPLATE_PAGES = {
-    "gwent_overview.html": "gwent.html",
-    "mtg_overview.html": "mtg.html",
-    "fab_overview.html": "fab.html",
-}
-
-# When set to true, external links to KeyForge/M:tG/Gwent/FaB card images will be used
-# if false images will be downloaded (which could be a copyright violation if you include them)
-USE_EXTERNAL_LINKS = True
-STATIC_EXCLUDES = []
-
-# Uncomment following line if you want document-relative URLs when developing
-# RELATIVE_URLS = True
+#!/usr/bin/env python
+# -*- coding: utf-8 -*- #
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+AUTHOR = "Sebastian Proost"
+SITENAME = "DeckLock"
+SITEURL = ""
+
+PATH = "content"
+DECKLOCK_CACHE = "dl_demo_cache"
+
+# Card and deck data is cached in json files in DECKLOCK_CACHE. Set to "sqlite" to use a single indexed SQLite
+# database (decklock.sqlite) instead, existing json caches are imported the first time it is used.
+DECKLOCK_CACHE_BACKEND = "json"
+
+# Number of processes used to parse deck files from cached data before the build, None uses all cores. Decks with
+# cards that aren't cached yet are parsed (and fetched) by the regular readers afterwards.
+DECKLOCK_WORKERS = 1
+
+# Cards that can't be found (e.g. misspelled names) are skipped and listed at the end of the build, they are only
+# looked up again after this number of days
+DECKLOCK_FAILED_LOOKUP_TTL = 7
+
+# Store the compiled templates in DECKLOCK_CACHE/templates, so they are only compiled again when they change. Use
+# "invoke precompile-templates" to compile the theme ahead of the first build.
+DECKLOCK_TEMPLATE_CACHE = False
+
+# Extensions used by the md filter (deck descriptions and WELCOME_MESSAGE), converted texts are cached in
+# DECKLOCK_CACHE/markdown.cache.json
+DECKLOCK_MARKDOWN_EXTENSIONS = ["markdown.extensions.extra"]
+
+# After the build, minify the HTML, CSS and JS files in the output and/or add compressed copies (.gz, .br) of the text
+# files for hosts that serve these directly. Only new or changed files are processed, .br files require Brotli.
+DECKLOCK_MINIFY = False
+DECKLOCK_PRECOMPRESS = []  # e.g. ["gz", "br"]
+
+# When images are downloaded (USE_EXTERNAL_LINKS = False), smaller copies of the card images can be created for the
+# overview tiles ("thumb") and the popups ("popup"). Formats supported by Pillow (webp, avif, jpg, ...) can be used,
+# this requires Pillow to be installed.
+# DECKLOCK_IMAGE_DERIVATIVES = {
+#     "thumb": {"width": 250, "format": "webp"},
+#     "popup": {"width": 488, "format": "webp"},
+# }
+
+TIMEZONE = "Europe/Paris"
+
+DEFAULT_LANG = "en"
+
+THEME = "theme"
+
+# Feed generation is usually not desired when developing
+FEED_ALL_ATOM = None
+CATEGORY_FEED_ATOM = None
+TRANSLATION_FEED_ATOM = None
+AUTHOR_FEED_ATOM = None
+AUTHOR_FEED_RSS = None
+
+# We don't need any of these pages
+AUTHORS_SAVE_AS = False
+TAGS_SAVE_AS = False
+CATEGORIES_SAVE_AS = False
+ARCHIVES_SAVE_AS = False
+
+AUTHOR_SAVE_AS = False
+TAG_SAVE_AS = False
+CATEGORY_SAVE_AS = False
+
+ARTICLE_URL = "posts/{slug}/"
+ARTICLE_SAVE_AS = "posts/{slug}/index.html"
+PAGE_URL = "pages/{slug}/"
+PAGE_SAVE_AS = "pages/{slug}/index.html"
+
+# Add the assets folder to the static data
+STATIC_PATHS = ["assets"]
+
+# Configure plugins
+PLUGIN_PATHS = ["plugins"]
+PLUGINS = [
+    "keyforge",
+    "mtg",
+    "gwent",
+    "fab",
+    "webassets",
+    "jinja_filters",
+    "jinja_cache",
+    "minify",
+]
+
+# Welcome message, will be shown on the index page. Markdown supported
+
+WELCOME_MESSAGE = """
+#### Hi There!
+
+
+Here you can find an over view of my collection of decks across various trading card games. Click on a game below to 
+get a list of the decks I own/played! 
+
+"""
+
+# KeyForge Section
+KEYFORGE_PATH = "data"
+KEYFORGE_ASSETS_PATH = "assets/keyforge"
+
+KEYFORGE_DECK_SAVE_AS = "keyforge/{slug}.html"
+KEYFORGE_DECKS_SAVE_AS = "keyforge.html"
+
+DOK_API_KEY = os.getenv("DOK_API_KEY", None)
+
+# Number of days after which the DoK stats, used to compute the percentiles of each deck, are fetched again
+DOK_STATS_TTL = 30
+
+# New decks are fetched from DoK and the Vault by KEYFORGE_FETCH_WORKERS threads, the cache is saved every
+# KEYFORGE_CHECKPOINT decks so an interrupted build can pick up where it stopped. The urls of both APIs can be changed,
+# e.g. to test against a local server.
+# KEYFORGE_FETCH_WORKERS = 8
+# KEYFORGE_CHECKPOINT = 10
+# KEYFORGE_DOK_API = "https://decksofkeyforge.com/public-api"
+# KEYFORGE_VAULT_API = "https://www.keyforgegame.com/api"
+
+# Magic: The Gathering Section
+MTG_PATH = "data"
+MTG_ASSETS_PATH = "assets/mtg"
+
+# Optionally, point to a Scryfall bulk data file (default-cards or oracle-cards) relative to PATH. Cards are then
+# looked up in a local index built from that file instead of querying the Scryfall API card by card.
+# MTG_SCRYFALL_BULK_DATA = "data/scryfall/default-cards.json"
+
+# Only these fields of Scryfall's card data are cached and passed to the templates (nested fields are separated by a
+# dot), add any field your own templates need. Set to None to keep the full card data.
+# MTG_CARD_FIELDS = ["name", "set", "type_line", "mana_cost", "cmc", "colors", "oracle_text", "image_uris.border_crop"]
+
+
+# Gwent Section
+GWENT_PATH = "data"
+GWENT_ASSETS_PATH = "assets/gwent"
+GWENT_CURRENT_VERSION = "8.2.0"
+# Parser used for gwent.one's search results, e.g. "lxml" if it is installed (compare with invoke benchmark-gwent)
+# GWENT_HTML_PARSER = "html.parser"
+
+# Flesh and Blood Section
+FAB_PATH = "data"
+FAB_ASSETS_PATH = "assets/fab"
+# Check for a new version of the card database after this many days (None to download it only once)
+FAB_CARD_DATABASE_REFRESH = None
+
+TEMPLATE_PAGES = {
+    "gwent_overview.html": "gwent.html",
+    "mtg_overview.html": "mtg.html",
+    "fab_overview.html": "fab.html",
+}
+
+# When set to true, external links to KeyForge/M:tG/Gwent/FaB card images will be used
+# if false images will be downloaded (which could be a copyright violation if you include them)
+USE_EXTERNAL_LINKS = True
+STATIC_EXCLUDES = []
+
+# Uncomment following line if you want document-relative URLs when developing
+# RELATIVE_URLS = True
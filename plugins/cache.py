@@ -0,0 +1,298 @@
+import json
+import os
+import posixpath
+import sqlite3
+from pathlib import Path
+
+from plugins.utils import write_json
+
+# Name of each cache, with the json file it is stored in and the keys to look up entries
+CACHE_TABLES = {
+    "mtg": ("mtg.cached_cards.json", ("card_set", "card_name")),
+    "gwent": ("gwent.cached_cards.json", ("card_version", "card_name")),
+    "fab": ("fab.cached_cards.json", ("card_name",)),
+    "keyforge": ("keyforge.cache.json", ("deck_id",)),
+    "keyforge_cards": ("keyforge_cards.cache.json", ("card_id",)),
+    "failed_lookups": ("failed_lookups.cache.json", ("game", "card_set", "card_name")),
+    "dok_decks": ("dok_decks.cache.json", ("stat",)),
+    "dok_stats": ("dok_stats.cache.json", ("field",)),
+    "decks": ("decks.cache.json", ("reader", "filename")),
+    "keyforge_pages": ("keyforge_pages.cache.json", ("deck_id",)),
+    "markdown": ("markdown.cache.json", ("hash",)),
+    "signatures": ("signatures.cache.json", ("name",)),
+}
+
+SQLITE_CACHE_FILE = "decklock.sqlite"
+
+# Caches and database connections opened during this build, shared by all readers and generators
+open_caches = {}
+open_connections = {}
+
+# Whether the keys requested from each cache are being recorded (see record_access)
+recording_access = False
+
+
+class JSONCache:
+    """Cache stored as nested dicts in a json file, the full file is loaded when the cache is opened"""
+
+    def __init__(self, path, key_columns):
+        self.path = path
+        self.depth = len(key_columns)
+        self.data = {}
+        self.dirty = False
+        self.accessed = None
+
+        if os.path.exists(self.path):
+            with open(self.path, "r") as fin:
+                self.data = json.load(fin)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def is_empty(self):
+        return len(self.data) == 0
+
+    def get(self, key, default=None):
+        if self.accessed is not None:
+            self.accessed.add(key)
+
+        node = self.data
+        for k in key:
+            if not isinstance(node, dict) or k not in node.keys():
+                return default
+            node = node[k]
+
+        return node
+
+    def set(self, key, value):
+        node = self.data
+        for k in key[:-1]:
+            node = node.setdefault(k, {})
+        node[key[-1]] = value
+        self.dirty = True
+
+    def delete(self, key):
+        node = self.data
+        for k in key[:-1]:
+            if k not in node.keys():
+                return
+            node = node[k]
+
+        if key[-1] in node.keys():
+            del node[key[-1]]
+            self.dirty = True
+
+    def keys(self):
+        return [key for key, _ in self.items()]
+
+    def items(self, node=None, key=()):
+        # Sorted by key, the order of the json file and the SQLite backend, also for entries added during the build
+        node = self.data if node is None else node
+        for k in sorted(node.keys()):
+            if len(key) + 1 < self.depth:
+                yield from self.items(node[k], key + (k,))
+            else:
+                yield key + (k,), node[k]
+
+    def flush(self):
+        if not self.dirty:
+            return
+
+        write_json(self.data, self.path)
+        self.dirty = False
+
+
+class SQLiteCache:
+    """
+    Cache stored as a table in a SQLite database, with one row per entry. Only rows that are requested are loaded and
+    all changes are written in a single transaction when the cache is flushed.
+    """
+
+    def __init__(self, connection, table, key_columns, json_path=None):
+        self.connection = connection
+        self.table = table
+        self.key_columns = key_columns
+        self.rows = {}
+        self.pending = set()
+        self.deleted = set()
+        self.accessed = None
+
+        columns = ", ".join(f"{c} TEXT NOT NULL" for c in key_columns)
+        with self.connection:
+            self.connection.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ({columns}, data TEXT, "
+                f"PRIMARY KEY ({', '.join(key_columns)}))"
+            )
+
+        if json_path is not None:
+            self.import_json(json_path)
+
+    @property
+    def key_condition(self):
+        return " AND ".join(f"{c} = ?" for c in self.key_columns)
+
+    def import_json(self, json_path):
+        """One-time import of the entries of an existing json cache"""
+        imported = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (f"imported_{self.table}",)
+        ).fetchone()
+
+        if imported is not None or not os.path.exists(json_path):
+            return
+
+        print(f"Importing {json_path} into the {self.table} table")
+        json_cache = JSONCache(json_path, self.key_columns)
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table} VALUES "
+                f"({', '.join('?' * (len(self.key_columns) + 1))})",
+                [key + (json.dumps(value),) for key, value in json_cache.items()],
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                (f"imported_{self.table}", json_path),
+            )
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    @property
+    def dirty(self):
+        return len(self.pending) > 0 or len(self.deleted) > 0
+
+    def is_empty(self):
+        if self.pending:
+            return False
+
+        return (
+            self.connection.execute(f"SELECT 1 FROM {self.table} LIMIT 1").fetchone()
+            is None
+        )
+
+    def get(self, key, default=None):
+        if self.accessed is not None:
+            self.accessed.add(key)
+
+        if key not in self.rows.keys():
+            row = self.connection.execute(
+                f"SELECT data FROM {self.table} WHERE {self.key_condition}", key
+            ).fetchone()
+            self.rows[key] = json.loads(row[0]) if row is not None else None
+
+        value = self.rows[key]
+        return value if value is not None else default
+
+    def set(self, key, value):
+        self.rows[key] = value
+        self.pending.add(key)
+        self.deleted.discard(key)
+
+    def delete(self, key):
+        self.rows[key] = None
+        self.pending.discard(key)
+        self.deleted.add(key)
+
+    def keys(self):
+        """Keys of all entries, without loading their data"""
+        key_columns = ", ".join(self.key_columns)
+        keys = {
+            tuple(row)
+            for row in self.connection.execute(
+                f"SELECT {key_columns} FROM {self.table}"
+            )
+        }
+        return sorted((keys | self.pending) - self.deleted)
+
+    def items(self):
+        seen = set()
+        key_columns = ", ".join(self.key_columns)
+        for row in self.connection.execute(
+            f"SELECT {key_columns}, data FROM {self.table} ORDER BY {key_columns}"
+        ):
+            key = tuple(row[:-1])
+            seen.add(key)
+            if key in self.deleted:
+                continue
+            if self.rows.get(key) is None:
+                self.rows[key] = json.loads(row[-1])
+            yield key, self.rows[key]
+
+        for key in sorted(self.pending - seen):
+            yield key, self.rows[key]
+
+    def flush(self):
+        if not self.dirty:
+            return
+
+        with self.connection:
+            self.connection.executemany(
+                f"DELETE FROM {self.table} WHERE {self.key_condition}", self.deleted
+            )
+            self.connection.executemany(
+                f"INSERT OR REPLACE INTO {self.table} VALUES "
+                f"({', '.join('?' * (len(self.key_columns) + 1))})",
+                [key + (json.dumps(self.rows[key]),) for key in self.pending],
+            )
+        self.pending.clear()
+        self.deleted.clear()
+
+
+def get_connection(cache_path):
+    if cache_path not in open_connections.keys():
+        connection = sqlite3.connect(posixpath.join(cache_path, SQLITE_CACHE_FILE))
+        with connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+        open_connections[cache_path] = connection
+
+    return open_connections[cache_path]
+
+
+def open_cache(settings, name):
+    """
+    Get the cache with the given name (see CACHE_TABLES), using the backend set in DECKLOCK_CACHE_BACKEND ("json" or
+    "sqlite"). Caches are opened only once per build and shared between all readers and generators.
+
+    :param settings: pelican settings
+    :param name: name of the cache to open
+    :return: JSONCache or SQLiteCache
+    """
+    cache_path = posixpath.join(settings.get("PATH"), settings.get("DECKLOCK_CACHE"))
+    backend = settings.get("DECKLOCK_CACHE_BACKEND", "json")
+
+    if (backend, cache_path, name) not in open_caches.keys():
+        Path(cache_path).mkdir(parents=True, exist_ok=True)
+
+        json_file, key_columns = CACHE_TABLES[name]
+        json_path = posixpath.join(cache_path, json_file)
+
+        if backend == "sqlite":
+            cache = SQLiteCache(
+                get_connection(cache_path), name, key_columns, json_path
+            )
+        elif backend == "json":
+            cache = JSONCache(json_path, key_columns)
+        else:
+            raise ValueError(f"Unknown DECKLOCK_CACHE_BACKEND: {backend}")
+
+        if recording_access:
+            cache.accessed = set()
+
+        open_caches[(backend, cache_path, name)] = cache
+
+    return open_caches[(backend, cache_path, name)]
+
+
+def record_access(enable=True):
+    """Start (or stop) keeping track of the keys requested from each cache, in the cache's accessed attribute"""
+    global recording_access
+    recording_access = enable
+
+    for cache in open_caches.values():
+        cache.accessed = set() if enable else None
+
+
+def flush_caches(pelican):
+    for cache in open_caches.values():
+        cache.flush()
@@ -1 +1 @@
-from .reader import *  # noqa: F403
+from .reader import *  # noqa: F403
@@ -1,376 +1,579 @@
-from pelican import signals
-from pelican.readers import BaseReader
-
-import json
-import os
-import posixpath
-import re
-from pathlib import Path
-from urllib.parse import urlparse
-import requests
-
-from plugins.utils import fetch_image, get_last_modified
-from pelican.utils import slugify
-
-
-class FABCardDatabase:
-    """Card database manager for the-fab-cube API"""
-
-    def __init__(self, cache_path):
-        self.base_url = (
-            "https://the-fab-cube.github.io/flesh-and-blood-cards/json/english"
-        )
-        self.cache_path = cache_path
-        self.cards = None
-        self.cards_by_name = {}
-
-    def load_cards(self):
-        """Load card data from cache or download from API"""
-        if self.cards is not None:
-            return
-
-        # Try loading from cache first
-        if os.path.exists(self.cache_path):
-            print(f"Loading FAB card database from cache: {self.cache_path}")
-            with open(self.cache_path, "r") as fin:
-                self.cards = json.load(fin)
-        else:
-            # Download from API
-            print(f"Downloading FAB card database from {self.base_url}/card.json")
-            response = requests.get(f"{self.base_url}/card.json")
-            response.raise_for_status()
-            self.cards = response.json()
-
-            # Save to cache
-            Path(self.cache_path).parent.mkdir(parents=True, exist_ok=True)
-            with open(self.cache_path, "w") as fout:
-                json.dump(self.cards, fout, indent=2)
-            print(f"Cached {len(self.cards)} cards to {self.cache_path}")
-
-        # Build lookup index by normalized name
-        self._build_name_index()
-
-    def _build_name_index(self):
-        """Build name-based lookup index for quick searches"""
-        self.cards_by_name = {}
-        for card in self.cards:
-            name_key = self._normalize_card_name(card["name"])
-            # Store as list to handle multiple cards with same normalized name
-            if name_key not in self.cards_by_name:
-                self.cards_by_name[name_key] = []
-            self.cards_by_name[name_key].append(card)
-
-    def _normalize_card_name(self, name):
-        """Convert card name to lookup key format"""
-        return name.lower().strip()
-
-    def get_card(self, card_name_with_color):
-        """
-        Get card by name with color suffix.
-        Handles format: "Card Name (red)", "Card Name (blue)", "Card Name (yellow)"
-        Also handles cards without color suffix.
-        """
-        if not self.cards:
-            self.load_cards()
-
-        # Parse card name and color from input
-        card_name = card_name_with_color.strip()
-        requested_color = None
-
-        # Extract color from parentheses
-        color_match = re.search(r"\((\w+)\)$", card_name)
-        if color_match:
-            requested_color = color_match.group(1).lower()
-            card_name = card_name[: color_match.start()].strip()
-
-        # Normalize the base card name for lookup
-        normalized = self._normalize_card_name(card_name)
-
-        # Find matching cards
-        candidate_cards = self.cards_by_name.get(normalized, [])
-
-        if not candidate_cards:
-            print(f"Warning: Card '{card_name_with_color}' not found in database")
-            return None
-
-        # If color was specified, find the card with matching pitch value
-        if requested_color:
-            pitch_map = {"red": "1", "yellow": "2", "blue": "3"}
-            target_pitch = pitch_map.get(requested_color)
-
-            for card in candidate_cards:
-                card_pitch = str(card.get("pitch", ""))
-                if card_pitch == target_pitch:
-                    return card
-
-            print(
-                f"Warning: Card '{card_name}' found but no {requested_color} variant (pitch {target_pitch})"
-            )
-            # Return first match as fallback
-            if candidate_cards:
-                return candidate_cards[0]
-            return None
-
-        # No color specified, return first match
-        return candidate_cards[0]
-
-    def convert_to_fabdb_format(self, card):
-        """
-        Convert the-fab-cube card format to fabdb.net-compatible format
-        for backward compatibility with existing templates.
-        """
-        if card is None:
-            return None
-
-        # Map pitch value to color
-        pitch_to_color = {"1": "red", "2": "yellow", "3": "blue"}
-        pitch = card.get("pitch", "")
-
-        # Get image URL from printings (use last printing, not first)
-        image_url = None
-        printings = card.get("printings", [])
-        if printings:
-            image_url = printings[-1].get("image_url")
-
-        # Build fabdb-compatible structure
-        return {
-            "name": card.get("name"),
-            "pitch": pitch,
-            "color": pitch_to_color.get(pitch),
-            "image": image_url,
-            "stats": {
-                "resource": pitch,  # Map pitch to resource for template compatibility
-                "cost": card.get("cost"),
-                "attack": card.get("power"),  # Map power to attack
-                "defense": card.get("defense"),
-                "health": card.get("health"),
-                "intelligence": card.get("intelligence"),
-            },
-            "keywords": card.get("types", []),
-            "card_keywords": card.get("card_keywords", []),
-            "functional_text": card.get("functional_text", ""),
-            "type_text": card.get("type_text", ""),
-            "blitz_legal": card.get("blitz_legal", False),
-            "cc_legal": card.get("cc_legal", False),
-        }
-
-
-def get_local_card_img_path(assets_cards_path, url):
-    if not url:
-        return None
-    img_filename = Path(urlparse(url).path).name
-    return posixpath.join(assets_cards_path, img_filename)
-
-
-def load_decklist(filename):
-    output = {
-        "title": "Unnamed Deck",
-        "class": "",
-        "hero": "",
-        "weapons": [],
-        "equipment": [],
-        "cards": [],
-    }
-
-    with open(filename) as fin:
-        lines = [line.strip() for line in fin.readlines()]
-
-    for line in lines:
-        if line.startswith("Deck build") or line == "":
-            continue
-        elif line.startswith("("):
-            count_str, card = line.split(" ", 1)
-            output["cards"].append(
-                (int(count_str.replace("(", "").replace(")", "")), card)
-            )
-        elif line.startswith("Class: "):
-            output["class"] = line.replace("Class: ", "")
-        elif line.startswith("Hero: "):
-            output["hero"] = line.replace("Hero: ", "")
-        elif line.startswith("Weapons: "):
-            output["weapons"] = [
-                w.strip() for w in line.replace("Weapons: ", "").split(",")
-            ]
-        elif line.startswith("Equipment: "):
-            output["equipment"] = [
-                w.strip() for w in line.replace("Equipment: ", "").split(",")
-            ]
-        else:
-            output["title"] = line
-
-    return output
-
-
-def build_stacks(deck_data, stack_size=4):
-    output_stacks = []
-    current_stack = []
-
-    for ix, card in enumerate(deck_data["cards"]):
-        for _ in range(card["count"]):
-            current_stack.append(ix)
-            if len(current_stack) == stack_size:
-                output_stacks.append(current_stack.copy())
-                current_stack = []
-
-    output_stacks.append(current_stack.copy())
-    return output_stacks
-
-
-class FaBReader(BaseReader):
-    enabled = True
-
-    file_extensions = ["fab"]
-
-    def __init__(self, settings):
-        super(FaBReader, self).__init__(settings)
-
-        self.cached_data = {}
-
-        # Initialize card database with cache path
-        db_cache_path = posixpath.join(
-            self.settings.get("PATH"),
-            self.settings.get("DECKLOCK_CACHE"),
-            "fab.card_database.json",
-        )
-        self.card_db = FABCardDatabase(db_cache_path)
-
-        # Load legacy cached data if exists
-        if os.path.exists(self.fab_data_path):
-            with open(self.fab_data_path, "r") as fin:
-                self.cached_data = json.load(fin)
-
-        Path(self.fab_assets_cards_path(full=True)).mkdir(parents=True, exist_ok=True)
-
-    @property
-    def fab_data_path(self):
-        Path(self.settings.get("PATH"), self.settings.get("DECKLOCK_CACHE")).mkdir(
-            parents=True, exist_ok=True
-        )
-
-        return posixpath.join(
-            self.settings.get("PATH"),
-            self.settings.get("DECKLOCK_CACHE"),
-            "fab.cached_cards.json",
-        )
-
-    def write_cache(self):
-        with open(self.fab_data_path, "w") as fout:
-            json.dump(
-                self.cached_data, fout, sort_keys=True, indent=4, separators=(",", ": ")
-            )
-
-    def fab_assets_cards_path(self, full=False):
-        if full:
-            return posixpath.join(
-                self.settings.get("PATH"), self.settings.get("FAB_ASSETS_PATH"), "cards"
-            )
-        else:
-            return posixpath.join(self.settings.get("FAB_ASSETS_PATH"), "cards")
-
-    def add_card_data(self, card_name):
-        try:
-            if card_name not in self.cached_data.keys():
-                # Fetch card from database and convert to fabdb format
-                raw_card = self.card_db.get_card(card_name)
-                card_data = self.card_db.convert_to_fabdb_format(raw_card)
-
-                if card_data is None:
-                    print(f"Error: Could not find card '{card_name}' in database")
-                    return
-
-                self.cached_data[card_name] = card_data
-            else:
-                card_data = self.cached_data[card_name]
-
-            img_url = card_data.get("image")
-            if img_url:
-                local_path = get_local_card_img_path(
-                    self.fab_assets_cards_path(full=False), img_url
-                )
-                self.cached_data[card_name]["image_path"] = local_path
-
-                local_path_full = get_local_card_img_path(
-                    self.fab_assets_cards_path(full=True), img_url
-                )
-                if not self.settings.get("USE_EXTERNAL_LINKS", True):
-                    fetch_image(img_url, local_path_full)
-        except Exception as e:
-            print(f"an error occurred fetching {card_name}")
-            print(e)
-
-    def add_decklist(self, decklist: dict):
-        if "hero" in decklist.keys():
-            self.add_card_data(decklist["hero"])
-        if "weapons" in decklist.keys():
-            for weapon in decklist["weapons"]:
-                self.add_card_data(weapon)
-        if "equipment" in decklist.keys():
-            for equipment in decklist["equipment"]:
-                self.add_card_data(equipment)
-        if "cards" in decklist.keys():
-            for _, card in decklist["cards"]:
-                self.add_card_data(card)
-
-        self.write_cache()
-
-    def parse_decklist(self, decklist):
-        parsed_cards = []
-
-        total_count = 0
-
-        pitch_to_color = {"1": "red", "2": "yellow", "3": "blue"}
-
-        for count, card in decklist["cards"]:
-            parsed_card = self.cached_data[card]
-            parsed_card["count"] = count
-            total_count += count
-
-            # Only set color if resource/pitch value exists and is not empty
-            resource = parsed_card.get("stats", {}).get("resource", "")
-            if resource and str(resource) in pitch_to_color:
-                parsed_card["color"] = pitch_to_color[str(resource)]
-
-            parsed_cards.append(parsed_card)
-
-        return {
-            "name": decklist["title"],
-            "hero": self.cached_data[decklist["hero"]],
-            "weapons": [self.cached_data[w] for w in decklist["weapons"]],
-            "equipment": [self.cached_data[e] for e in decklist["equipment"]],
-            "cards": parsed_cards,
-            "format": "Blitz" if total_count == 40 else "Classic Constructed",
-            "class": decklist["class"],
-        }
-
-    def read(self, filename):
-        decklist = load_decklist(filename)
-        self.add_decklist(decklist)
-
-        deck_data = self.parse_decklist(decklist)
-        deck_data["stacks"] = build_stacks(deck_data)
-
-        print(f"Adding FaB {deck_data['name']}")
-        deck_data["title"] = deck_data["name"]
-        deck_data["slug"] = slugify(
-            deck_data["title"],
-            regex_subs=self.settings.get("SLUG_REGEX_SUBSTITUTIONS", []),
-        )
-
-        deck_data["url"] = f"fab/{deck_data['slug']}/"
-        deck_data["save_as"] = f"{deck_data['url']}index.html"
-        deck_data["category"] = "FaB_Deck"
-        deck_data["date"] = get_last_modified(filename)
-        deck_data["template"] = "fab_deck"
-
-        for key, value in deck_data.items():
-            deck_data[key] = self.process_metadata(key, value)
-
-        return "", deck_data
-
-
-def add_reader(readers):
-    readers.reader_classes["fab"] = FaBReader
-
-
-def register():
-    signals.readers_init.connect(add_reader)
+from pelican import signals
+from pelican.readers import BaseReader
+
+import hashlib
+import json
+import mmap
+import os
+import posixpath
+import re
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+
+from plugins.cache import flush_caches, open_cache
+from plugins.failed_lookups import (
+    add_failed_lookup,
+    get_failed_lookup,
+    report_failed_lookups,
+)
+from plugins.images import download_images, generate_derivatives, queue_image
+from plugins.incremental import read_deck
+from plugins.parallel import CacheMiss, get_preparsed_deck, preparse_decks
+from plugins.records import DeckCard, freeze
+from plugins.utils import (
+    get_last_modified,
+    http_client,
+    iter_json_array,
+    project_fields,
+    write_json,
+)
+from pelican.utils import slugify
+
+
+# Fields of the-fab-cube's cards that are used (see convert_to_fabdb_format), only these are compiled
+FAB_CARD_FIELDS = [
+    "name",
+    "pitch",
+    "cost",
+    "power",
+    "defense",
+    "health",
+    "intelligence",
+    "types",
+    "card_keywords",
+    "functional_text",
+    "type_text",
+    "blitz_legal",
+    "cc_legal",
+]
+
+# Card databases loaded during this build, by path, shared by all readers
+card_databases = {}
+
+
+class FABCardDatabase:
+    """
+    Card database manager for the-fab-cube API. The downloaded card.json is compiled once into a file with one compact
+    json line per card and an index with the position of the cards for each name. The compiled file is memory-mapped,
+    only the cards that are requested are decoded.
+    """
+
+    def __init__(self, cache_path, url=None, refresh_days=None):
+        """
+        :param cache_path: path of the downloaded card.json, the compiled database is stored next to it
+        :param url: url of card.json, by default the one of the-fab-cube
+        :param refresh_days: check for a new version of card.json when it was last checked this number of days ago,
+                             None to never check (it is only downloaded when it doesn't exist)
+        """
+        self.base_url = (
+            "https://the-fab-cube.github.io/flesh-and-blood-cards/json/english"
+        )
+        self.url = url or f"{self.base_url}/card.json"
+        self.refresh_days = refresh_days
+        self.cache_path = cache_path
+        self.index_path = f"{os.path.splitext(cache_path)[0]}.index.json"
+        self.download_path = f"{os.path.splitext(cache_path)[0]}.download.json"
+        self.cards = None
+        self.cards_by_name = {}
+        self.load_error = None
+
+    @property
+    def signature(self):
+        stat = os.stat(self.cache_path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def needs_refresh(self):
+        if not os.path.exists(self.cache_path):
+            return True
+
+        if self.refresh_days is None:
+            return False
+
+        checked = 0
+        if os.path.exists(self.download_path):
+            with open(self.download_path, "r") as fin:
+                checked = json.load(fin).get("checked", 0)
+
+        return time.time() - checked > self.refresh_days * 24 * 60 * 60
+
+    def download(self):
+        """
+        Download card.json, streaming it to a temporary file which replaces the existing one once it is complete. The
+        ETag and Last-Modified headers of the previous download are sent along, so an unchanged file isn't downloaded
+        again.
+
+        :return: True if a new version of card.json was downloaded
+        """
+        validators = {}
+        if os.path.exists(self.download_path) and os.path.exists(self.cache_path):
+            with open(self.download_path, "r") as fin:
+                validators = json.load(fin)
+
+        headers = {}
+        if validators.get("etag"):
+            headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            headers["If-Modified-Since"] = validators["last_modified"]
+
+        if headers:
+            print(f"Checking for a new FAB card database at {self.url}")
+        else:
+            print(f"Downloading FAB card database from {self.url}")
+        with http_client.get(self.url, headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                print("FAB card database is up to date")
+                write_json(dict(validators, checked=time.time()), self.download_path)
+                return False
+
+            response.raise_for_status()
+
+            Path(self.cache_path).parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "wb") as fout:
+                    for chunk in response.iter_content(chunk_size=1 << 16):
+                        fout.write(chunk)
+                os.replace(tmp_path, self.cache_path)
+            finally:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "checked": time.time(),
+            }
+
+        write_json(validators, self.download_path)
+        print(f"Cached FAB card database to {self.cache_path}")
+
+        return True
+
+    def load_cards(self):
+        """Load the compiled card database, downloading and compiling it first if needed"""
+        if self.cards is not None:
+            return
+
+        # Without a database the download isn't tried again for every card, only on the next build
+        if self.load_error is not None:
+            raise self.load_error
+
+        if self.needs_refresh():
+            try:
+                self.download()
+            except requests.RequestException as e:
+                # An outdated database is still better than none
+                if not os.path.exists(self.cache_path):
+                    self.load_error = e
+                    raise
+                print(f"Warning: could not refresh the FAB card database: {e}")
+
+        index = None
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as fin:
+                index = json.load(fin)
+
+        cards_path = None
+        if index is not None and "cards_file" in index.keys():
+            cards_path = posixpath.join(
+                os.path.dirname(self.index_path), index["cards_file"]
+            )
+
+        if (
+            cards_path is None
+            or index["signature"] != self.signature
+            or not os.path.exists(cards_path)
+        ):
+            index, cards_path = self.compile()
+
+        self.cards_by_name = index["cards"]
+        with open(cards_path, "rb") as fin:
+            self.cards = (
+                mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+                if os.path.getsize(cards_path) > 0
+                else b""
+            )
+
+    def compile(self):
+        """
+        Compile the card database, streaming the cards from card.json. The index holds the (offset, length) of each
+        card in the compiled file by normalized name, as a list to handle multiple cards with the same name.
+
+        Each version of the compiled file gets its own name, which is stored in the index. The index is replaced last,
+        so it always refers to a complete file, and a build using the previous version can keep reading it.
+
+        :return: tuple with the index and the path of the compiled file
+        """
+        print(f"Compiling FAB card database {self.cache_path}")
+        signature = self.signature
+        cards_file = (
+            f"{os.path.splitext(os.path.basename(self.cache_path))[0]}."
+            f"{hashlib.sha1(signature.encode('utf-8')).hexdigest()[:12]}.cards"
+        )
+        cards_path = posixpath.join(os.path.dirname(self.index_path), cards_file)
+        index = {"signature": signature, "cards_file": cards_file, "cards": {}}
+        tmp_path = f"{cards_path}.{os.getpid()}.tmp"
+
+        with open(tmp_path, "wb") as fout:
+            for card in iter_json_array(self.cache_path):
+                compact_card = project_fields(card, FAB_CARD_FIELDS)
+
+                # Only the last printing is used, for its image
+                printings = card.get("printings", [])
+                compact_card["printings"] = [
+                    project_fields(p, ["image_url"]) for p in printings[-1:]
+                ]
+
+                line = json.dumps(compact_card, separators=(",", ":")).encode("utf-8")
+                name_key = self._normalize_card_name(card["name"])
+                index["cards"].setdefault(name_key, []).append([fout.tell(), len(line)])
+                fout.write(line + b"\n")
+
+        os.replace(tmp_path, cards_path)
+        write_json(index, self.index_path)
+        print(f"Compiled {sum(len(v) for v in index['cards'].values())} FAB cards")
+
+        # Remove previous versions of the compiled file
+        prefix = f"{os.path.splitext(os.path.basename(self.cache_path))[0]}."
+        for f in os.listdir(os.path.dirname(self.index_path) or "."):
+            if f.startswith(prefix) and f.endswith(".cards") and f != cards_file:
+                try:
+                    os.remove(posixpath.join(os.path.dirname(self.index_path), f))
+                except OSError:
+                    pass
+
+        return index, cards_path
+
+    def get_cards_by_name(self, name_key):
+        """Decode the cards with the given normalized name from the compiled database"""
+        return [
+            json.loads(self.cards[offset : offset + length])
+            for offset, length in self.cards_by_name.get(name_key, [])
+        ]
+
+    def _normalize_card_name(self, name):
+        """Convert card name to lookup key format"""
+        return name.lower().strip()
+
+    def get_card(self, card_name_with_color):
+        """
+        Get card by name with color suffix.
+        Handles format: "Card Name (red)", "Card Name (blue)", "Card Name (yellow)"
+        Also handles cards without color suffix.
+        """
+        self.load_cards()
+
+        # Parse card name and color from input
+        card_name = card_name_with_color.strip()
+        requested_color = None
+
+        # Extract color from parentheses
+        color_match = re.search(r"\((\w+)\)$", card_name)
+        if color_match:
+            requested_color = color_match.group(1).lower()
+            card_name = card_name[: color_match.start()].strip()
+
+        # Normalize the base card name for lookup
+        normalized = self._normalize_card_name(card_name)
+
+        # Find matching cards
+        candidate_cards = self.get_cards_by_name(normalized)
+
+        if not candidate_cards:
+            return None
+
+        # If color was specified, find the card with matching pitch value
+        if requested_color:
+            pitch_map = {"red": "1", "yellow": "2", "blue": "3"}
+            target_pitch = pitch_map.get(requested_color)
+
+            for card in candidate_cards:
+                card_pitch = str(card.get("pitch", ""))
+                if card_pitch == target_pitch:
+                    return card
+
+            print(
+                f"Warning: Card '{card_name}' found but no {requested_color} variant (pitch {target_pitch})"
+            )
+            # Return first match as fallback
+            if candidate_cards:
+                return candidate_cards[0]
+            return None
+
+        # No color specified, return first match
+        return candidate_cards[0]
+
+    def convert_to_fabdb_format(self, card):
+        """
+        Convert the-fab-cube card format to fabdb.net-compatible format
+        for backward compatibility with existing templates.
+        """
+        if card is None:
+            return None
+
+        # Map pitch value to color
+        pitch_to_color = {"1": "red", "2": "yellow", "3": "blue"}
+        pitch = card.get("pitch", "")
+
+        # Get image URL from printings (use last printing, not first)
+        image_url = None
+        printings = card.get("printings", [])
+        if printings:
+            image_url = printings[-1].get("image_url")
+
+        # Build fabdb-compatible structure
+        return {
+            "name": card.get("name"),
+            "pitch": pitch,
+            "color": pitch_to_color.get(pitch),
+            "image": image_url,
+            "stats": {
+                "resource": pitch,  # Map pitch to resource for template compatibility
+                "cost": card.get("cost"),
+                "attack": card.get("power"),  # Map power to attack
+                "defense": card.get("defense"),
+                "health": card.get("health"),
+                "intelligence": card.get("intelligence"),
+            },
+            "keywords": card.get("types", []),
+            "card_keywords": card.get("card_keywords", []),
+            "functional_text": card.get("functional_text", ""),
+            "type_text": card.get("type_text", ""),
+            "blitz_legal": card.get("blitz_legal", False),
+            "cc_legal": card.get("cc_legal", False),
+        }
+
+
+def clear_card_databases(pelican):
+    """The card databases are loaded again on the next build (e.g. with --autoreload)"""
+    card_databases.clear()
+
+
+def get_local_card_img_path(assets_cards_path, url):
+    if not url:
+        return None
+    img_filename = Path(urlparse(url).path).name
+    return posixpath.join(assets_cards_path, img_filename)
+
+
+def load_decklist(filename):
+    output = {
+        "title": "Unnamed Deck",
+        "class": "",
+        "hero": "",
+        "weapons": [],
+        "equipment": [],
+        "cards": [],
+    }
+
+    with open(filename) as fin:
+        lines = [line.strip() for line in fin.readlines()]
+
+    for line in lines:
+        if line.startswith("Deck build") or line == "":
+            continue
+        elif line.startswith("("):
+            count_str, card = line.split(" ", 1)
+            output["cards"].append(
+                (int(count_str.replace("(", "").replace(")", "")), card)
+            )
+        elif line.startswith("Class: "):
+            output["class"] = line.replace("Class: ", "")
+        elif line.startswith("Hero: "):
+            output["hero"] = line.replace("Hero: ", "")
+        elif line.startswith("Weapons: "):
+            output["weapons"] = [
+                w.strip() for w in line.replace("Weapons: ", "").split(",")
+            ]
+        elif line.startswith("Equipment: "):
+            output["equipment"] = [
+                w.strip() for w in line.replace("Equipment: ", "").split(",")
+            ]
+        else:
+            output["title"] = line
+
+    return output
+
+
+def build_stacks(deck_data, stack_size=4):
+    output_stacks = []
+    current_stack = []
+
+    for ix, card in enumerate(deck_data["cards"]):
+        for _ in range(card["count"]):
+            current_stack.append(ix)
+            if len(current_stack) == stack_size:
+                output_stacks.append(current_stack.copy())
+                current_stack = []
+
+    output_stacks.append(current_stack.copy())
+    return output_stacks
+
+
+class FaBReader(BaseReader):
+    enabled = True
+
+    file_extensions = ["fab"]
+
+    def __init__(self, settings):
+        super(FaBReader, self).__init__(settings)
+
+        self.cached_data = open_cache(self.settings, "fab")
+        self.cache_only = False
+
+        # Initialize card database with cache path, the database is shared by all readers
+        db_cache_path = posixpath.join(
+            self.settings.get("PATH"),
+            self.settings.get("DECKLOCK_CACHE"),
+            "fab.card_database.json",
+        )
+        if db_cache_path not in card_databases.keys():
+            card_databases[db_cache_path] = FABCardDatabase(
+                db_cache_path,
+                self.settings.get("FAB_CARD_DATABASE_URL"),
+                self.settings.get("FAB_CARD_DATABASE_REFRESH"),
+            )
+        self.card_db = card_databases[db_cache_path]
+
+        Path(self.fab_assets_cards_path(full=True)).mkdir(parents=True, exist_ok=True)
+
+    def fab_assets_cards_path(self, full=False):
+        if full:
+            return posixpath.join(
+                self.settings.get("PATH"), self.settings.get("FAB_ASSETS_PATH"), "cards"
+            )
+        else:
+            return posixpath.join(self.settings.get("FAB_ASSETS_PATH"), "cards")
+
+    def add_card_data(self, card_name):
+        if self.cache_only and (card_name,) not in self.cached_data:
+            raise CacheMiss(card_name)
+
+        try:
+            card_data = self.cached_data.get((card_name,))
+            if card_data is None:
+                if get_failed_lookup(self.settings, "fab", "", card_name) is not None:
+                    return
+
+                # Fetch card from database and convert to fabdb format
+                raw_card = self.card_db.get_card(card_name)
+                card_data = self.card_db.convert_to_fabdb_format(raw_card)
+
+                if card_data is None:
+                    reason = "not found in the card database"
+                    add_failed_lookup(self.settings, "fab", "", card_name, reason)
+                    return
+
+                self.cached_data.set((card_name,), card_data)
+
+            img_url = card_data.get("image")
+            if img_url:
+                local_path_full = get_local_card_img_path(
+                    self.fab_assets_cards_path(full=True), img_url
+                )
+                if not self.settings.get("USE_EXTERNAL_LINKS", True):
+                    queue_image(img_url, local_path_full)
+        except Exception as e:
+            print(f"an error occurred fetching {card_name}")
+            print(e)
+
+    def add_decklist(self, decklist: dict):
+        if "hero" in decklist.keys():
+            self.add_card_data(decklist["hero"])
+        if "weapons" in decklist.keys():
+            for weapon in decklist["weapons"]:
+                self.add_card_data(weapon)
+        if "equipment" in decklist.keys():
+            for equipment in decklist["equipment"]:
+                self.add_card_data(equipment)
+        if "cards" in decklist.keys():
+            for _, card in decklist["cards"]:
+                self.add_card_data(card)
+
+    def parse_decklist(self, decklist):
+        parsed_cards = []
+
+        total_count = 0
+
+        pitch_to_color = {"1": "red", "2": "yellow", "3": "blue"}
+
+        for count, card in decklist["cards"]:
+            cached_card = self.cached_data.get((card,))
+            if cached_card is None:
+                # Cards that couldn't be found are skipped
+                continue
+
+            total_count += count
+
+            # Only set color if resource/pitch value exists and is not empty
+            resource = cached_card.get("stats", {}).get("resource", "")
+            if resource and str(resource) in pitch_to_color:
+                cached_card = dict(cached_card, color=pitch_to_color[str(resource)])
+
+            parsed_cards.append(DeckCard(card=freeze(cached_card), count=count))
+
+        return {
+            "name": decklist["title"],
+            "hero": freeze(self.cached_data.get((decklist["hero"],))),
+            "weapons": [
+                freeze(self.cached_data.get((w,)))
+                for w in decklist["weapons"]
+                if (w,) in self.cached_data
+            ],
+            "equipment": [
+                freeze(self.cached_data.get((e,)))
+                for e in decklist["equipment"]
+                if (e,) in self.cached_data
+            ],
+            "cards": parsed_cards,
+            "format": "Blitz" if total_count == 40 else "Classic Constructed",
+            "class": decklist["class"],
+        }
+
+    def parse_deck(self, filename):
+        decklist = load_decklist(filename)
+        self.add_decklist(decklist)
+
+        deck_data = self.parse_decklist(decklist)
+        deck_data["stacks"] = build_stacks(deck_data)
+
+        print(f"Adding FaB {deck_data['name']}")
+        deck_data["title"] = deck_data["name"]
+        deck_data["slug"] = slugify(
+            deck_data["title"],
+            regex_subs=self.settings.get("SLUG_REGEX_SUBSTITUTIONS", []),
+        )
+
+        deck_data["url"] = f"fab/{deck_data['slug']}/"
+        deck_data["save_as"] = f"{deck_data['url']}index.html"
+        deck_data["category"] = "FaB_Deck"
+        deck_data["date"] = get_last_modified(filename)
+        deck_data["template"] = "fab_deck"
+
+        return deck_data
+
+    def read(self, filename):
+        deck_data = get_preparsed_deck(filename) or read_deck(self, filename)
+
+        parsed = {}
+        for key, value in deck_data.items():
+            parsed[key] = self.process_metadata(key, value)
+
+        return "", parsed
+
+
+def add_reader(readers):
+    readers.reader_classes["fab"] = FaBReader
+
+
+def register():
+    signals.readers_init.connect(add_reader)
+    signals.article_generator_init.connect(preparse_decks)
+    signals.article_generator_finalized.connect(download_images)
+    signals.article_generator_finalized.connect(generate_derivatives)
+    signals.finalized.connect(flush_caches)
+    signals.finalized.connect(report_failed_lookups)
+    signals.finalized.connect(clear_card_databases)
@@ -0,0 +1,52 @@
+import time
+
+from plugins.cache import open_cache
+
+# Reason each lookup failed (or was skipped) during this build, by (game, set or version, card name)
+failed_lookups = {}
+
+
+def get_failed_lookup(settings, game, card_set, card_name):
+    """
+    Check whether looking up a card failed on an earlier build. Failed lookups are skipped, rather than requested again
+    on every build, until they are older than DECKLOCK_FAILED_LOOKUP_TTL days (default 7).
+
+    :param settings: pelican settings
+    :param game: game of the card (mtg, gwent, fab)
+    :param card_set: set or version of the card, empty if the game doesn't use these
+    :param card_name: name of the card as used in the deck file
+    :return: the reason the lookup failed or None if the card should be looked up
+    """
+    failure = open_cache(settings, "failed_lookups").get((game, card_set, card_name))
+    ttl = settings.get("DECKLOCK_FAILED_LOOKUP_TTL", 7) * 24 * 60 * 60
+
+    # Lookups that failed during this build aren't retried, whatever the TTL
+    if (game, card_set, card_name) in failed_lookups.keys():
+        return failed_lookups[(game, card_set, card_name)]
+
+    if failure is None or time.time() - failure["time"] > ttl:
+        return None
+
+    failed_lookups[(game, card_set, card_name)] = failure["reason"]
+    return failure["reason"]
+
+
+def add_failed_lookup(settings, game, card_set, card_name, reason):
+    """Keep track of a card that couldn't be found, see get_failed_lookup"""
+    open_cache(settings, "failed_lookups").set(
+        (game, card_set, card_name), {"reason": reason, "time": time.time()}
+    )
+    failed_lookups[(game, card_set, card_name)] = reason
+
+
+def report_failed_lookups(pelican):
+    """Print all cards that couldn't be found at the end of the build, instead of failing on the first one"""
+    if not failed_lookups:
+        return
+
+    print(f"Warning: {len(failed_lookups)} cards could not be found and were skipped")
+    for (game, card_set, card_name), reason in sorted(failed_lookups.items()):
+        card = f"{card_name} ({card_set})" if card_set else card_name
+        print(f"  {game}: {card} - {reason}")
+
+    failed_lookups.clear()
@@ -0,0 +1,140 @@
+"""
+Benchmark of the parser for gwent.one's search results, comparing it to the previous parser (html.parser with a
+separate search for each part of a card) and checking both return the same data.
+
+Run with `invoke benchmark-gwent`, saved responses can be passed with --responses (comma separated), e.g. saved with
+
+    curl -X POST https://gwent.one/search/abilities -d "q=geralt&version=11.10.0&Token=1&view=sCard&language=en"
+
+without responses one with all cards in the cache is built (like a fuzzy search returning many cards).
+"""
+
+import html
+import json
+import time
+
+from bs4 import BeautifulSoup
+
+from plugins.gwent.reader import parse_card_data
+
+try:
+    import lxml  # noqa: F401
+except ImportError:
+    lxml = None
+
+
+def legacy_parse_card_data(card_data, card_name):
+    soup = BeautifulSoup(card_data, "html.parser")
+
+    index = -1
+    for ix, result in enumerate(soup.find_all("div", class_="card-name")):
+        if card_name.lower() == str(result.text.replace("É", "E")).lower():
+            index = ix
+
+    card_attributes = soup.find_all("div", class_="card-wrap card-data")[index]
+    card_name = soup.find_all("div", class_="card-name")[index]
+    card_category = soup.find_all("div", class_="card-category")[index]
+    card_body_ability = soup.find_all("div", class_="card-body-ability")[index]
+
+    image_url = "https://gwent.one/image/gwent/assets/card/art/medium/%d.jpg" % int(
+        card_attributes.get("data-artid").replace("j", "")
+    )
+
+    return {
+        "name": card_name.text,
+        "art_id": card_attributes.get("data-artid"),
+        "power": card_attributes.get("data-power"),
+        "armor": card_attributes.get("data-armor"),
+        "provision": int(card_attributes.get("data-provision")),
+        "faction": card_attributes.get("data-faction"),
+        "color": card_attributes.get("data-color"),
+        "type": card_attributes.get("data-type"),
+        "rarity": card_attributes.get("data-rarity"),
+        "category": card_category.text,
+        "body_ability": card_body_ability.text,
+        "body_ability_html": str(card_body_ability),
+        "image_url": image_url,
+    }
+
+
+def build_response(cards):
+    """Search result, in gwent.one's sCard layout, with the given cards (as stored in the cache)"""
+    output = []
+    for card in cards:
+        attributes = " ".join(
+            f'data-{k.replace("_", "")}="{html.escape(str(card[k]))}"'
+            for k in [
+                "art_id",
+                "power",
+                "armor",
+                "provision",
+                "faction",
+                "color",
+                "type",
+                "rarity",
+            ]
+        )
+        output.append(
+            f'<div class="card-wrap card-data" {attributes}>\n'
+            f'<div class="card-header"><div class="card-name">{html.escape(card["name"])}</div>\n'
+            f'<div class="card-category">{html.escape(card["category"])}</div></div>\n'
+            f'<div class="card-body">{card["body_ability_html"]}</div>\n'
+            "</div>"
+        )
+
+    return "\n".join(output)
+
+
+def get_card_names(response):
+    soup = BeautifulSoup(response, "html.parser")
+    return [
+        div.text.replace("É", "E") for div in soup.find_all("div", class_="card-name")
+    ]
+
+
+def run(parse, response, card_names):
+    start = time.perf_counter()
+    output = [parse(response, name) for name in card_names]
+
+    return output, time.perf_counter() - start
+
+
+def main(paths, cache_file):
+    """
+    :param paths: paths to saved responses
+    :param cache_file: gwent cache, used to build a response when no paths are given
+    """
+    responses = {}
+    for path in paths:
+        with open(path, "r", encoding="utf-8") as fin:
+            responses[path] = fin.read()
+
+    if not responses:
+        with open(cache_file, "r") as fin:
+            cached_cards = json.load(fin)
+
+        cards = {}
+        for version in cached_cards.values():
+            cards.update({card["name"]: card for card in version.values()})
+        responses["cached cards"] = build_response(cards.values())
+
+    parsers = {
+        "previous parser": legacy_parse_card_data,
+        "single pass (html.parser)": parse_card_data,
+    }
+    if lxml is not None:
+        parsers["single pass (lxml)"] = lambda r, n: parse_card_data(r, n, "lxml")
+
+    for name, response in responses.items():
+        card_names = get_card_names(response)
+        print(f"{name}: {len(card_names)} cards, {len(response)} characters")
+
+        expected = None
+        for parser_name, parse in parsers.items():
+            output, duration = run(parse, response, card_names)
+            expected = output if expected is None else expected
+            status = "identical" if output == expected else "DIFFERENT OUTPUT"
+
+            print(
+                f"  {parser_name:<28} {duration * 1000 / len(card_names):8.2f} ms per card ({status})"
+            )
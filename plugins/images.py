@@ -0,0 +1,292 @@
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from pathlib import Path
+from urllib.parse import urlparse
+
+from jinja2 import pass_context
+
+from plugins.utils import fetch_image, write_json
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+IMAGE_STORE_MANIFEST = "image_store.json"
+DERIVATIVES_MANIFEST = "image_derivatives.json"
+
+# Images that still need to be downloaded, local path (where older versions stored the image) by url
+pending_images = {}
+
+# When set to a list, queued images are also added to it (to keep track of the images each deck needs)
+image_log = None
+
+# Path of each downloaded image in the image store (relative to PATH), by url
+image_store = {}
+
+# Derivatives of the images available in this build, by path of the original image in the image store
+image_derivatives = {}
+
+
+def queue_image(img_url, img_file_path):
+    """
+    Add an image to download, all queued images are added to the image store at once by download_images. If the image
+    was already downloaded to img_file_path (by an older version), that file is imported instead.
+    """
+    pending_images[img_url] = img_file_path
+
+    if image_log is not None:
+        image_log.append((img_url, img_file_path))
+
+
+def take_pending_images():
+    images = dict(pending_images)
+    pending_images.clear()
+
+    return images
+
+
+def get_file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as fin:
+        for chunk in iter(lambda: fin.read(1 << 16), b""):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def get_store_paths(settings):
+    """
+    :return: tuple with the content path, the image store (relative to the content path) and the folder used for
+             downloads in progress
+    """
+    content_path = settings.get("PATH")
+    store_path = settings.get("DECKLOCK_IMAGE_STORE", "assets/images")
+    download_path = posixpath.join(
+        content_path, settings.get("DECKLOCK_CACHE"), "downloads"
+    )
+
+    return content_path, store_path, download_path
+
+
+def store_image(img_url, legacy_path, content_path, store_path, download_path):
+    """
+    Add an image to the content-addressed image store: the file is named after the hash of its content, so identical
+    images fetched from different urls are stored once and different images can't overwrite each other.
+
+    :return: path of the image in the store (relative to content_path) or None if it couldn't be downloaded
+    """
+    extension = Path(urlparse(img_url).path).suffix.lower()
+
+    if os.path.exists(legacy_path):
+        source_path = legacy_path
+    else:
+        url_hash = hashlib.sha1(img_url.encode("utf-8")).hexdigest()
+        source_path = posixpath.join(download_path, f"{url_hash}{extension}")
+        if not fetch_image(img_url, source_path):
+            return None
+
+    file_hash = get_file_hash(source_path)
+    image_path = posixpath.join(store_path, file_hash[:2], f"{file_hash}{extension}")
+    image_path_full = posixpath.join(content_path, image_path)
+
+    if not os.path.exists(image_path_full):
+        Path(image_path_full).parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = f"{image_path_full}.{threading.get_ident()}.tmp"
+        shutil.copyfile(source_path, tmp_path)
+        os.replace(tmp_path, image_path_full)
+
+    if source_path != legacy_path:
+        os.remove(source_path)
+
+    return image_path
+
+
+def download_images(generator):
+    """
+    Add all queued images to the image store, downloading them using a pool of DECKLOCK_IMAGE_WORKERS threads. This
+    runs once the articles are read, before the static files are collected, so the images are part of the current
+    build. Images listed in the store's manifest (url -> path) are not fetched again.
+    """
+    content_path, store_path, download_path = get_store_paths(generator.settings)
+    manifest_path = posixpath.join(
+        content_path, generator.settings.get("DECKLOCK_CACHE"), IMAGE_STORE_MANIFEST
+    )
+
+    if not image_store and os.path.exists(manifest_path):
+        with open(manifest_path, "r") as fin:
+            image_store.update(json.load(fin))
+
+    images = {
+        url: legacy_path
+        for url, legacy_path in take_pending_images().items()
+        if url not in image_store.keys()
+        or not os.path.exists(posixpath.join(content_path, image_store[url]))
+    }
+    if len(images) == 0:
+        return
+
+    Path(download_path).mkdir(parents=True, exist_ok=True)
+    workers = generator.settings.get("DECKLOCK_IMAGE_WORKERS", 8)
+    print(f"Fetching {len(images)} images using {workers} threads")
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(
+            executor.map(
+                partial(
+                    store_image,
+                    content_path=content_path,
+                    store_path=store_path,
+                    download_path=download_path,
+                ),
+                images.keys(),
+                images.values(),
+            )
+        )
+
+    for url, image_path in zip(images.keys(), results):
+        if image_path is not None:
+            image_store[url] = image_path
+
+    failed = results.count(None)
+    if failed > 0:
+        print(f"Warning: {failed} of {len(images)} images could not be fetched")
+
+    if failed < len(images):
+        write_json(image_store, manifest_path)
+
+
+@pass_context
+def get_local_image(context, img_url, derivative=None):
+    """
+    Jinja filter returning the url of a downloaded image (SITEURL/path in the image store), or the original url if it
+    wasn't downloaded. With the name of a derivative (e.g. "thumb"), that version of the image is used if it exists.
+    """
+    if img_url not in image_store.keys():
+        return img_url
+
+    image_path = image_store[img_url]
+    if derivative is not None:
+        image_path = get_derivative(image_path, derivative)
+
+    return f"{context.get('SITEURL', '')}/{image_path}"
+
+
+def get_derivative_path(image_path, name, image_format, store_path):
+    """Derivatives are stored in the image store, e.g. assets/images/derivatives/thumb/<hash>.webp"""
+    stem = posixpath.splitext(posixpath.basename(image_path))[0]
+
+    return posixpath.join(store_path, "derivatives", name, f"{stem}.{image_format}")
+
+
+def make_derivatives(source_path, targets):
+    """
+    Create resized copies of an image (runs in a worker process)
+
+    :param source_path: path to the original image
+    :param targets: list of (output path, maximum width, format) tuples
+    :return: True if all derivatives were created
+    """
+    try:
+        with Image.open(source_path) as img:
+            img.load()
+            for output_path, width, image_format in targets:
+                derivative = img.copy()
+                if width is not None and derivative.width > width:
+                    height = round(derivative.height * width / derivative.width)
+                    derivative = derivative.resize((width, height), Image.LANCZOS)
+
+                if image_format in ["jpg", "jpeg"] and derivative.mode != "RGB":
+                    derivative = derivative.convert("RGB")
+
+                Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = f"{output_path}.{os.getpid()}.tmp"
+                derivative.save(
+                    tmp_path, format="JPEG" if image_format == "jpg" else image_format
+                )
+                os.replace(tmp_path, output_path)
+    except Exception as e:
+        print(f"Warning: could not create derivatives of {source_path}: {e}")
+        return False
+
+    return True
+
+
+def generate_derivatives(generator):
+    """
+    Create the derivatives set in DECKLOCK_IMAGE_DERIVATIVES (e.g. thumbnails in WebP or AVIF) of all images in the
+    image store, using a pool of DECKLOCK_WORKERS processes. As images in the store are named after their content,
+    images are only processed again when the settings of the derivatives changed. Requires Pillow.
+    """
+    image_derivatives.clear()
+
+    derivatives = generator.settings.get("DECKLOCK_IMAGE_DERIVATIVES", {})
+    if not derivatives or not image_store:
+        return
+
+    if Image is None:
+        print("Warning: Pillow is not installed, image derivatives are not created")
+        return
+
+    content_path, store_path, _ = get_store_paths(generator.settings)
+    manifest_path = posixpath.join(
+        content_path, generator.settings.get("DECKLOCK_CACHE"), DERIVATIVES_MANIFEST
+    )
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as fin:
+            manifest = json.load(fin)
+
+    config = {
+        k: [v.get("width"), v.get("format", "webp")] for k, v in derivatives.items()
+    }
+
+    jobs = []
+    output = {}
+    for image_path in sorted(set(image_store.values())):
+        paths = {
+            name: get_derivative_path(image_path, name, image_format, store_path)
+            for name, (_, image_format) in config.items()
+        }
+
+        if manifest.get(image_path) != config or not all(
+            os.path.exists(posixpath.join(content_path, p)) for p in paths.values()
+        ):
+            targets = [
+                (posixpath.join(content_path, paths[name]), width, image_format)
+                for name, (width, image_format) in config.items()
+            ]
+            jobs.append((image_path, paths, targets))
+        else:
+            image_derivatives[image_path] = paths
+            output[image_path] = config
+
+    if len(jobs) > 0:
+        workers = generator.settings.get("DECKLOCK_WORKERS", 1)
+        print(f"Creating derivatives of {len(jobs)} images")
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                make_derivatives,
+                [posixpath.join(content_path, j[0]) for j in jobs],
+                [j[2] for j in jobs],
+            )
+
+            for (image_path, paths, _), success in zip(jobs, results):
+                if success:
+                    image_derivatives[image_path] = paths
+                    output[image_path] = config
+
+    if output != manifest:
+        write_json(output, manifest_path)
+
+
+def get_derivative(image_path, name):
+    """:return: the path of a derivative of an image in the store, or the original if there is none"""
+    return image_derivatives.get(image_path, {}).get(name, image_path)
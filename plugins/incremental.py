@@ -0,0 +1,214 @@
+import glob
+import hashlib
+import inspect
+import json
+import os
+
+from plugins import images
+from plugins.cache import open_cache, open_caches, record_access
+from plugins.records import Record, dump_record, freeze, load_json_record
+from plugins.utils import get_last_modified
+
+# Settings that change the result of parsing a deck, stored results are parsed again when one of these changes
+DECK_SETTINGS = [
+    "PATH",
+    "USE_EXTERNAL_LINKS",
+    "SLUG_REGEX_SUBSTITUTIONS",
+    "MTG_CARD_FIELDS",
+    "MTG_ASSETS_PATH",
+    "GWENT_ASSETS_PATH",
+    "FAB_ASSETS_PATH",
+]
+
+# Version of each reader's code, by reader class
+code_versions = {}
+
+
+def get_hash(data):
+    return hashlib.sha1(data).hexdigest()
+
+
+def get_code_version(reader_class):
+    """
+    Hash of the code a reader (or another class or module of a plugin) depends on: the modules of its plugin (e.g.
+    mtg/reader.py and mtg/bulk.py) and the modules shared by all plugins (records.py, images.py, ...). Stored results
+    are invalidated when any of these change.
+    """
+    if reader_class not in code_versions.keys():
+        plugin_path = os.path.dirname(os.path.abspath(inspect.getfile(reader_class)))
+        shared_path = os.path.dirname(os.path.abspath(__file__))
+
+        sha = hashlib.sha1()
+        for path in sorted(glob.glob(os.path.join(plugin_path, "*.py"))) + sorted(
+            glob.glob(os.path.join(shared_path, "*.py"))
+        ):
+            with open(path, "rb") as fin:
+                sha.update(fin.read())
+
+        code_versions[reader_class] = sha.hexdigest()
+
+    return code_versions[reader_class]
+
+
+def get_settings_version(settings):
+    return get_hash(
+        json.dumps([settings.get(s) for s in DECK_SETTINGS], default=str).encode(
+            "utf-8"
+        )
+    )
+
+
+def get_fingerprint(settings, reader_class, filename, entries):
+    """
+    Fingerprint of a deck file's parsed result, combining the content and date of the deck file, the version of the
+    reader, the settings in DECK_SETTINGS and the current value of every cache entry used to parse the deck
+
+    :param settings: pelican settings
+    :param reader_class: class of the reader parsing the deck
+    :param filename: path to the deck file
+    :param entries: list of [cache name, key] pairs used by the deck
+    :return: fingerprint (str)
+    """
+    with open(filename, "rb") as fin:
+        file_hash = get_hash(fin.read())
+
+    versions = [
+        get_hash(
+            json.dumps(
+                open_cache(settings, name).get(tuple(key)), sort_keys=True
+            ).encode("utf-8")
+        )
+        for name, key in entries
+    ]
+
+    fingerprint = [
+        file_hash,
+        get_last_modified(filename),
+        get_code_version(reader_class),
+        get_settings_version(settings),
+        versions,
+    ]
+
+    return get_hash(json.dumps(fingerprint).encode("utf-8"))
+
+
+def get_result_key(settings, reader_class, filename):
+    return (
+        reader_class.__name__,
+        os.path.relpath(filename, settings.get("PATH")).replace(os.sep, "/"),
+    )
+
+
+def get_stored_deck(settings, reader_class, filename):
+    """
+    :return: the stored result of a deck file if it is still up to date (see get_fingerprint), None otherwise. Decks
+             with cards that couldn't be found are always parsed again, so these are retried once their failure expires
+             and are included in the report of failed lookups.
+    """
+    results = open_cache(settings, "decks")
+    stored = results.get(get_result_key(settings, reader_class, filename))
+
+    if stored is None or any(name == "failed_lookups" for name, _ in stored["entries"]):
+        return None
+
+    if stored["fingerprint"] != get_fingerprint(
+        settings, reader_class, filename, stored["entries"]
+    ):
+        return None
+
+    return stored
+
+
+def get_entry_references(settings, entries):
+    """:return: dict with the [cache name, key] pair of each cache entry used by a deck, by its record (see freeze)"""
+    references = {}
+    for name, key in entries:
+        record = freeze(open_cache(settings, name).get(tuple(key)))
+        if isinstance(record, Record):
+            references.setdefault(record, [name, key])
+
+    return references
+
+
+def dump_deck_value(value, references):
+    """Records of cache entries are stored as a reference to the entry, other records as their fields"""
+    if isinstance(value, Record) and value in references.keys():
+        return {"__cache__": references[value]}
+
+    return dump_record(value)
+
+
+def load_deck_value(data, settings):
+    """Cache entries are looked up again when a stored result is loaded, see dump_deck_value"""
+    if "__cache__" in data.keys():
+        name, key = data["__cache__"]
+        return freeze(open_cache(settings, name).get(tuple(key)))
+
+    return load_json_record(data)
+
+
+def store_deck(settings, reader_class, filename, metadata, entries, deck_images):
+    results = open_cache(settings, "decks")
+    key = get_result_key(settings, reader_class, filename)
+    references = get_entry_references(settings, entries)
+
+    stored = {
+        "fingerprint": get_fingerprint(settings, reader_class, filename, entries),
+        "entries": entries,
+        "images": deck_images,
+        # Stored as a string, so the order of the keys is kept when the cache is written with sorted keys. The cards
+        # refer to their cache entries, which are unchanged as long as the fingerprint is.
+        "metadata": json.dumps(
+            metadata, default=lambda value: dump_deck_value(value, references)
+        ),
+    }
+
+    if results.get(key) != stored:
+        results.set(key, stored)
+
+
+def record_deck(reader, filename):
+    """
+    Parse a deck file, keeping track of the cache entries and images it uses
+
+    :return: tuple with the deck's metadata, the [cache name, key] pairs used and the [url, path] pairs of the images
+    """
+    record_access()
+    images.image_log = []
+
+    try:
+        metadata = reader.parse_deck(filename)
+
+        entries = []
+        for (_, _, name), cache in open_caches.items():
+            if name != "decks":
+                entries += [[name, list(key)] for key in sorted(cache.accessed)]
+
+        deck_images = [list(image) for image in images.image_log]
+    finally:
+        record_access(False)
+        images.image_log = None
+
+    return metadata, entries, deck_images
+
+
+def read_deck(reader, filename):
+    """
+    Get the metadata of a deck file, the stored result is used when neither the deck file nor the cached data it
+    depends on changed since it was parsed, otherwise the deck is parsed and the result stored for the next build
+    """
+    stored = get_stored_deck(reader.settings, type(reader), filename)
+
+    if stored is not None:
+        for img_url, img_file_path in stored["images"]:
+            images.queue_image(img_url, img_file_path)
+
+        return json.loads(
+            stored["metadata"],
+            object_hook=lambda data: load_deck_value(data, reader.settings),
+        )
+
+    metadata, entries, deck_images = record_deck(reader, filename)
+    store_deck(reader.settings, type(reader), filename, metadata, entries, deck_images)
+
+    return metadata
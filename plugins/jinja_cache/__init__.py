@@ -0,0 +1 @@
+from .jinja_cache import register as register
@@ -0,0 +1,92 @@
+import hashlib
+import posixpath
+from pathlib import Path
+
+from jinja2 import FileSystemBytecodeCache, TemplateError
+from jinja2.bccache import Bucket
+from pelican import signals
+
+# Options of the Jinja environment that change the compiled code of a template
+ENVIRONMENT_OPTIONS = [
+    "block_start_string",
+    "block_end_string",
+    "variable_start_string",
+    "variable_end_string",
+    "comment_start_string",
+    "comment_end_string",
+    "line_statement_prefix",
+    "line_comment_prefix",
+    "trim_blocks",
+    "lstrip_blocks",
+    "newline_sequence",
+    "keep_trailing_newline",
+    "optimized",
+]
+
+
+def get_environment_hash(environment):
+    """Hash of the environment's options and extensions, templates compiled with other options are not reused"""
+    options = [repr(getattr(environment, o, None)) for o in ENVIRONMENT_OPTIONS]
+    options.append(
+        # autoescape can be a function, which is identified by its name
+        getattr(environment.autoescape, "__qualname__", repr(environment.autoescape))
+    )
+    options += sorted(environment.extensions.keys())
+
+    return hashlib.sha1("|".join(options).encode("utf-8")).hexdigest()
+
+
+class TemplateBytecodeCache(FileSystemBytecodeCache):
+    """
+    Compiled templates, stored in files so they are reused by the next builds. Jinja checks the hash of a template's
+    source before using its compiled version, the options of the environment are added to the key here.
+    """
+
+    def get_bucket(self, environment, name, filename, source):
+        key = self.get_cache_key(
+            f"{name}|{get_environment_hash(environment)}", filename
+        )
+        bucket = Bucket(environment, key, self.get_source_checksum(source))
+        self.load_bytecode(bucket)
+
+        return bucket
+
+
+def get_template_cache_path(settings):
+    return posixpath.join(
+        settings.get("PATH"), settings.get("DECKLOCK_CACHE"), "templates"
+    )
+
+
+def add_bytecode_cache(generator):
+    """
+    Store compiled templates in DECKLOCK_CACHE/templates when DECKLOCK_TEMPLATE_CACHE is enabled. Every generator
+    (including KeyForgeGenerator) has its own environment, they share the compiled templates.
+    """
+    if not generator.settings.get("DECKLOCK_TEMPLATE_CACHE", False):
+        return
+
+    cache_path = get_template_cache_path(generator.settings)
+    Path(cache_path).mkdir(parents=True, exist_ok=True)
+    generator.env.bytecode_cache = TemplateBytecodeCache(cache_path)
+
+
+def precompile_templates(environment):
+    """
+    Compile all templates of an environment, storing them in its bytecode cache
+
+    :return: number of templates compiled
+    """
+    count = 0
+    for name in environment.list_templates(filter_func=lambda n: n.endswith(".html")):
+        try:
+            environment.get_template(name)
+            count += 1
+        except TemplateError as e:
+            print(f"Warning: could not compile template {name}: {e}")
+
+    return count
+
+
+def register():
+    signals.generator_init.connect(add_bytecode_cache)
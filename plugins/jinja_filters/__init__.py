@@ -1 +1 @@
-from .jinja_filters import register as register
+from .jinja_filters import register as register
@@ -1,12 +1,239 @@
-from pelican import signals
-from json import dumps
-
-
-def add_filter(pelican):
-    """Add to_json filter to Pelican."""
-    pelican.env.filters.update({"to_json": dumps})
-
-
-def register():
-    """Plugin registration."""
-    signals.generator_init.connect(add_filter)
+from pelican import signals
+import codecs
+import hashlib
+import json
+import math
+import re
+from functools import lru_cache
+from json.encoder import encode_basestring_ascii
+
+import markdown
+
+from plugins.cache import flush_caches, open_cache
+from plugins.images import get_local_image
+from plugins.records import Record
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# orjson writes some floats differently than json (1e-05 as 0.00001, 1e+16 as 1e16). To find these quickly, digits
+# are replaced by 0 and the characters before a value by ":", an exponent then follows ":0" (or ":-0") outside strings.
+FLOAT_TRANSLATION = bytes.maketrans(b"0123456789E[,", b"0000000000e::")
+FLOAT_EXPONENT = re.compile(rb":-?0+(?:\.0+)?e")
+
+# Markdown filters used during this build, by hash of their configuration
+markdown_filters = {}
+
+# Output of to_json for the objects serialized while rendering the current page, by id. The object is kept as well,
+# so its id can't be reused by another object.
+json_cache = {}
+
+
+def json_default(value):
+    """Records (e.g. the cards in a deck) are serialized as dicts"""
+    if isinstance(value, Record):
+        return value._asdict()
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def escape_non_ascii(error):
+    """Encoding error handler escaping the characters json escapes (ensure_ascii) the way json does"""
+    return (
+        encode_basestring_ascii(error.object[error.start : error.end])[1:-1],
+        error.end,
+    )
+
+
+codecs.register_error("json_escape", escape_non_ascii)
+
+
+def is_json_compatible(output):
+    """:return: False if orjson's output may differ from json's, due to the format of a float"""
+    return (
+        b"0.0000" not in output
+        and FLOAT_EXPONENT.search((b":" + output).translate(FLOAT_TRANSLATION)) is None
+    )
+
+
+def has_non_finite_float(value):
+    """:return: True if value contains NaN or an infinite float, which orjson writes as null (json as NaN, Infinity)"""
+    if isinstance(value, float):
+        return not math.isfinite(value)
+
+    if isinstance(value, Record):
+        value = value._asdict()
+
+    if isinstance(value, dict):
+        value = list(value.values())
+
+    if isinstance(value, (list, tuple)):
+        return any(has_non_finite_float(v) for v in value)
+
+    return False
+
+
+def dumps_compact(value):
+    """
+    json.dumps with compact separators, using orjson when it is installed. Non-ASCII characters are escaped like json
+    does, values orjson writes differently (some floats, NaN and Infinity, dicts with keys that aren't strings) are
+    written by json, so the output is the same either way.
+    """
+    if orjson is not None:
+        try:
+            output = orjson.dumps(value, default=json_default)
+        except TypeError:
+            output = None
+
+        # The value is only searched for NaN and Infinity when orjson wrote a null
+        if output is not None and b"null" in output and has_non_finite_float(value):
+            output = None
+
+        if output is not None and is_json_compatible(output):
+            if output.isascii() and b"\x7f" not in output:
+                return output.decode("ascii")
+
+            return (
+                output.decode("utf-8")
+                .encode("ascii", "json_escape")
+                .decode("ascii")
+                .replace("\x7f", "\\u007f")
+            )
+
+    return json.dumps(value, separators=(",", ":"), default=json_default)
+
+
+def to_json(value, **kwargs):
+    """
+    Serialize a value for use in a template (e.g. chart data), the same object is only serialized once per page.
+    Arguments are passed to json.dumps, e.g. to_json(indent=2), these values aren't memoized.
+    """
+    if kwargs:
+        return json.dumps(value, **{"default": json_default, **kwargs})
+
+    if not isinstance(value, (dict, list, tuple, Record)):
+        return dumps_compact(value)
+
+    if id(value) not in json_cache.keys():
+        json_cache[id(value)] = (value, dumps_compact(value))
+
+    return json_cache[id(value)][1]
+
+
+def clear_json_cache(path, context=None):
+    json_cache.clear()
+
+
+class MarkdownFilter:
+    """
+    Markdown filter (md) for the welcome message and deck descriptions, which are rendered on many pages. Each text is
+    converted once: the results are kept in memory (the most recently used) and in the markdown cache, by hash of the
+    text and the configuration of the extensions. The texts used during the build are kept, so the results of texts
+    that were edited or removed can be dropped from the cache (see prune_markdown_cache).
+    """
+
+    def __init__(self, settings, extensions, extension_configs, memory_size=1024):
+        self.settings = settings
+        self.markdown = markdown.Markdown(
+            extensions=extensions, extension_configs=extension_configs
+        )
+        self.config_hash = get_markdown_config_hash(extensions, extension_configs)
+        self.convert = lru_cache(maxsize=memory_size)(self.convert_cached)
+        self.used = set()
+
+    def get_key(self, content):
+        return (
+            hashlib.sha1(f"{self.config_hash}\n{content}".encode("utf-8")).hexdigest(),
+        )
+
+    def convert_cached(self, content):
+        cache = open_cache(self.settings, "markdown")
+        key = self.get_key(content)
+
+        html = cache.get(key)
+        if html is None:
+            try:
+                html = self.markdown.convert(content)
+            finally:
+                # The instance keeps state (e.g. footnotes and references) between conversions
+                self.markdown.reset()
+            cache.set(key, html)
+
+        return html
+
+    def __call__(self, content, *args):
+        self.used.add(content)
+        return self.convert(content)
+
+
+def get_markdown_config_hash(extensions, extension_configs):
+    config = [extensions, extension_configs, markdown.__version__]
+    return hashlib.sha1(
+        json.dumps(config, sort_keys=True, default=repr).encode("utf-8")
+    ).hexdigest()
+
+
+def get_markdown_filter(settings):
+    """
+    The md filter, using the extensions in DECKLOCK_MARKDOWN_EXTENSIONS (with DECKLOCK_MARKDOWN_EXTENSION_CONFIGS),
+    shared by all generators
+    """
+    extensions = settings.get(
+        "DECKLOCK_MARKDOWN_EXTENSIONS", ["markdown.extensions.extra"]
+    )
+    extension_configs = settings.get("DECKLOCK_MARKDOWN_EXTENSION_CONFIGS", {})
+
+    config_hash = get_markdown_config_hash(extensions, extension_configs)
+    if config_hash not in markdown_filters.keys():
+        markdown_filters[config_hash] = MarkdownFilter(
+            settings, extensions, extension_configs
+        )
+
+    return markdown_filters[config_hash]
+
+
+def prune_markdown_cache(pelican):
+    """
+    Remove the converted texts that weren't used during this build from the markdown cache, e.g. of descriptions that
+    were edited or of decks that were removed. Nothing is removed when only some pages are written (WRITE_SELECTED).
+    """
+    if pelican.settings.get("WRITE_SELECTED"):
+        return
+
+    used = set()
+    for markdown_filter in markdown_filters.values():
+        used.update(
+            markdown_filter.get_key(content) for content in markdown_filter.used
+        )
+        markdown_filter.used.clear()
+
+    cache = open_cache(pelican.settings, "markdown")
+    for key in cache.keys():
+        if key not in used:
+            cache.delete(key)
+
+    cache.flush()
+
+
+def add_filter(pelican):
+    """Add to_json, md and local_image filters to Pelican."""
+    pelican.env.filters.update(
+        {
+            "to_json": to_json,
+            "local_image": get_local_image,
+        }
+    )
+
+    # A md filter set in JINJA_FILTERS is used as is
+    if "md" not in pelican.settings["JINJA_FILTERS"].keys():
+        pelican.env.filters["md"] = get_markdown_filter(pelican.settings)
+
+
+def register():
+    """Plugin registration."""
+    signals.generator_init.connect(add_filter)
+    signals.content_written.connect(clear_json_cache)
+    signals.finalized.connect(prune_markdown_cache)
+    signals.finalized.connect(flush_caches)
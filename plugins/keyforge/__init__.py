@@ -1 +1 @@
-from .keyforge import *  # noqa: F403
+from .keyforge import *  # noqa: F403
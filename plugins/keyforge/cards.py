@@ -0,0 +1,39 @@
+def split_deck_cards(deck_data, cards_cache):
+    """
+    Move the cards linked to a deck (vault_data._linked.cards) to the shared card table, so each card is stored once
+    however many decks contain it. The deck keeps the ids of its cards, the number of copies of each card is in
+    vault_data.data._links.cards. A card that differs from the version already in the table is kept in the deck.
+
+    :param deck_data: cached data of a deck, with the full cards or with card ids
+    :param cards_cache: keyforge_cards cache, new cards are added to it
+    :return: copy of the deck data with the ids of the cards
+    """
+    linked = deck_data["vault_data"]["_linked"]
+
+    cards = []
+    for card in linked["cards"]:
+        if not isinstance(card, dict):
+            cards.append(card)
+            continue
+
+        stored = cards_cache.get((card["id"],))
+        if stored is None:
+            cards_cache.set((card["id"],), card)
+            stored = card
+
+        cards.append(card["id"] if stored == card else card)
+
+    return dict(
+        deck_data,
+        vault_data=dict(deck_data["vault_data"], _linked=dict(linked, cards=cards)),
+    )
+
+
+def get_deck_cards(deck_data, cards_cache):
+    """
+    :return: list with the cards of a deck, looked up in the shared card table (None for cards missing in the table)
+    """
+    return [
+        card if isinstance(card, dict) else cards_cache.get((card,))
+        for card in deck_data["vault_data"]["_linked"]["cards"]
+    ]
@@ -1,82 +1,178 @@
-import json
-import os
-from pathlib import Path
-from urllib.parse import urlparse
-import posixpath
-
-from pelican import generators
-
-
-def get_local_card_img_path(settings, url):
-    img_filename = Path(urlparse(url).path).name
-    return os.path.join(settings["KEYFORGE_ASSETS_PATH"], "cards", img_filename)
-
-
-def get_local_house_img_path(settings, url):
-    img_filename = Path(urlparse(url).path).name
-    return os.path.join(settings["KEYFORGE_ASSETS_PATH"], "houses", img_filename)
-
-
-class KeyForgeGenerator(generators.Generator):
-    """Generator Class to produce pages based on keyforge.cache.json"""
-
-    template_overview = "keyforge_overview.html"
-    template_deck = "keyforge_deck.html"
-
-    def keyforge_data_path(self, settings):
-        Path(settings.get("PATH"), settings.get("DECKLOCK_CACHE")).mkdir(
-            parents=True, exist_ok=True
-        )
-
-        return posixpath.join(
-            settings.get("PATH"),
-            settings.get("DECKLOCK_CACHE"),
-            "keyforge.cache.json",
-        )
-
-    def __init__(self, context, settings, path, theme, output_path, **kwargs):
-        with open(self.keyforge_data_path(settings)) as fin:
-            self.keyforge_data = json.load(fin)
-
-        for k, v in self.keyforge_data.items():
-            v["path"] = settings["KEYFORGE_DECK_SAVE_AS"].replace("{slug}", k)
-            for card in v["vault_data"]["_linked"]["cards"]:
-                card["count"] = v["vault_data"]["data"]["_links"]["cards"].count(
-                    card["id"]
-                )
-
-                card["image_path"] = get_local_card_img_path(
-                    settings, card["front_image"]
-                )
-
-            for house in v["vault_data"]["_linked"]["houses"]:
-                house["image_path"] = get_local_house_img_path(settings, house["image"])
-
-        super(KeyForgeGenerator, self).__init__(
-            context, settings, path, theme, output_path, **kwargs
-        )
-
-    def generate_output(self, writer):
-        self.generate_keyforge_overview_page(writer, self.keyforge_data)
-
-        for k, v in self.keyforge_data.items():
-            self.generate_keyforge_deck_page(writer, k, v)
-
-    def generate_keyforge_deck_page(self, writer, deck_id, data):
-        print(f"Generating KeyForge deck : {deck_id}")
-        self.context["keyforge_data"] = data
-        template = self.env.get_template(self.template_deck)
-        rurls = self.settings["RELATIVE_URLS"]
-        path = data["path"]
-        writer.write_file(path, template, self.context, rurls, override_output=True)
-        del self.context["keyforge_data"]
-
-    def generate_keyforge_overview_page(self, writer, data):
-        print("Generating KeyForge overview...", end="")
-        self.context["keyforge_data"] = data
-        template = self.env.get_template(self.template_overview)
-        rurls = self.settings["RELATIVE_URLS"]
-        path = self.settings["KEYFORGE_DECKS_SAVE_AS"]
-        writer.write_file(path, template, self.context, rurls, override_output=True)
-        del self.context["keyforge_data"]
-        print("Done!")
+import hashlib
+import json
+import os
+from collections import Counter
+
+from pelican import generators
+
+from plugins.cache import open_cache
+from plugins.images import image_derivatives, image_store
+from plugins.incremental import get_code_version
+from plugins.jinja_filters import jinja_filters
+from plugins.keyforge.cards import get_deck_cards
+from plugins.records import DeckCard, Record, dump_record, freeze
+
+# Settings used when rendering a deck page, the pages are rendered again when one of these changes. Settings that
+# change with every deck added (KEYFORGE_DECK_COUNT) are only used on the overview, which is always rendered.
+KEYFORGE_PAGE_SETTINGS = [
+    "SITEURL",
+    "SITENAME",
+    "SITEDESCRIPTION",
+    "AUTHOR",
+    "PLUGINS",
+    "THEME",
+    "RELATIVE_URLS",
+    "USE_EXTERNAL_LINKS",
+    "JINJA_ENVIRONMENT",
+    "JINJA_FILTERS",
+    "JINJA_GLOBALS",
+    "KEYFORGE_DECK_SAVE_AS",
+    "KEYFORGE_DECKS_SAVE_AS",
+]
+
+
+def get_json_value(value):
+    """Stable representation of settings that can't be stored as json, e.g. the functions in JINJA_FILTERS"""
+    if isinstance(value, Record):
+        return dump_record(value)
+
+    if callable(value):
+        return (
+            f"{getattr(value, '__module__', '')}.{getattr(value, '__qualname__', '')}"
+        )
+
+    return str(value)
+
+
+def get_hash(data):
+    return hashlib.sha1(
+        json.dumps(data, sort_keys=True, default=get_json_value).encode("utf-8")
+    ).hexdigest()
+
+
+class KeyForgeGenerator(generators.Generator):
+    """Generator Class to produce pages based on keyforge.cache.json and keyforge_cards.cache.json"""
+
+    template_overview = "keyforge_overview.html"
+    template_deck = "keyforge_deck.html"
+
+    def __init__(self, context, settings, path, theme, output_path, **kwargs):
+        self.keyforge_data = {}
+        self.cards_cache = open_cache(settings, "keyforge_cards")
+
+        # The cached decks are shared with the rest of the build, so they are copied rather than modified here
+        for (k,), v in open_cache(settings, "keyforge").items():
+            self.keyforge_data[k] = dict(
+                v, path=settings["KEYFORGE_DECK_SAVE_AS"].replace("{slug}", k)
+            )
+
+        super(KeyForgeGenerator, self).__init__(
+            context, settings, path, theme, output_path, **kwargs
+        )
+
+    def get_deck_data(self, data):
+        """
+        Data of a deck with its cards looked up in the card table and the number of copies of each card added, this is
+        done when the deck's page is rendered. Each card is a record shared by all decks, only the entries with the
+        number of copies are created for each deck.
+        """
+        card_counts = Counter(data["vault_data"]["data"]["_links"]["cards"])
+
+        cards = [
+            DeckCard(card=freeze(card), count=card_counts[card["id"]])
+            for card in get_deck_cards(data, self.cards_cache)
+            if card is not None
+        ]
+
+        linked = dict(data["vault_data"]["_linked"], cards=cards)
+        return dict(data, vault_data=dict(data["vault_data"], _linked=linked))
+
+    def get_static_hash(self):
+        """
+        Hash of the theme's static files, the pages link to the stylesheet bundled by webassets with a version (e.g.
+        style.min.css?648ed1e2) based on the content of these files
+        """
+        sha = hashlib.sha1()
+        for static_path in self.settings["THEME_STATIC_PATHS"]:
+            root_path = os.path.join(self.theme, static_path)
+            for root, dirs, files in os.walk(root_path):
+                dirs.sort()
+                for filename in sorted(files):
+                    path = os.path.join(root, filename)
+                    sha.update(os.path.relpath(path, root_path).encode("utf-8"))
+                    with open(path, "rb") as fin:
+                        sha.update(fin.read())
+
+        return sha.hexdigest()
+
+    def get_templates_hash(self):
+        """
+        Hash of all templates, the theme's static files, the settings in KEYFORGE_PAGE_SETTINGS and the code of this
+        plugin and the Jinja filters, as a deck page depends on the base template, macros, stylesheets, SITEURL, ...
+        """
+        templates = {
+            name: self.env.loader.get_source(self.env, name)[0]
+            for name in self.env.loader.list_templates()
+        }
+        settings = {s: self.settings.get(s) for s in KEYFORGE_PAGE_SETTINGS}
+        code = [get_code_version(type(self)), get_code_version(jinja_filters)]
+
+        return get_hash([templates, self.get_static_hash(), settings, code])
+
+    def get_deck_fingerprint(self, data, templates_hash):
+        """
+        Fingerprint of a deck page, combining the deck's data, the templates and the local paths of its images (which
+        can change between builds)
+        """
+        linked = data["vault_data"]["_linked"]
+        images = [card["front_image"] for card in linked["cards"]] + [
+            house["image"] for house in linked["houses"]
+        ]
+        local_images = {
+            url: [image_store.get(url), image_derivatives.get(image_store.get(url))]
+            for url in images
+        }
+
+        return get_hash([data, templates_hash, local_images])
+
+    def generate_output(self, writer):
+        self.generate_keyforge_overview_page(writer, self.keyforge_data)
+
+        # Deck pages are only rendered again when their fingerprint changed since the previous build
+        rendered_pages = open_cache(self.settings, "keyforge_pages")
+        templates_hash = self.get_templates_hash()
+        skipped = 0
+
+        for k, v in self.keyforge_data.items():
+            data = self.get_deck_data(v)
+            fingerprint = self.get_deck_fingerprint(data, templates_hash)
+            output_file = os.path.join(self.output_path, v["path"])
+
+            if rendered_pages.get((k,)) == fingerprint and os.path.exists(output_file):
+                skipped += 1
+                continue
+
+            self.generate_keyforge_deck_page(writer, k, data)
+            rendered_pages.set((k,), fingerprint)
+
+        if skipped > 0:
+            print(f"Skipped {skipped} unchanged KeyForge decks")
+
+    def generate_keyforge_deck_page(self, writer, deck_id, data):
+        print(f"Generating KeyForge deck : {deck_id}")
+        self.context["keyforge_data"] = data
+        template = self.env.get_template(self.template_deck)
+        rurls = self.settings["RELATIVE_URLS"]
+        path = data["path"]
+        writer.write_file(path, template, self.context, rurls, override_output=True)
+        del self.context["keyforge_data"]
+
+    def generate_keyforge_overview_page(self, writer, data):
+        print("Generating KeyForge overview...", end="")
+        self.context["keyforge_data"] = data
+        template = self.env.get_template(self.template_overview)
+        rurls = self.settings["RELATIVE_URLS"]
+        path = self.settings["KEYFORGE_DECKS_SAVE_AS"]
+        writer.write_file(path, template, self.context, rurls, override_output=True)
+        del self.context["keyforge_data"]
+        print("Done!")
@@ -1,236 +1,409 @@
-import os
-import json
-import requests
-from pelican import signals
-from pathlib import Path
-from urllib.parse import urlparse
-
-from plugins.keyforge.generator import KeyForgeGenerator
-from plugins.utils import fetch_image
-
-
-def get_content_path(pelican):
-    return pelican.settings.get("PATH")
-
-
-def get_keyforge_data(pelican):
-    keyforge_path = pelican.settings.get("KEYFORGE_PATH", None)
-
-    if keyforge_path is None:
-        return []
-
-    content_path = get_content_path(pelican)
-
-    input_path = os.path.join(content_path, keyforge_path, "keyforge.json")
-    with open(input_path, "r") as fin:
-        output = json.load(fin)
-
-    return output
-
-
-def get_keyforge_cache_path(pelican):
-    cache_path = pelican.settings.get("DECKLOCK_CACHE", None)
-    content_path = get_content_path(pelican)
-
-    Path(content_path, cache_path).mkdir(parents=True, exist_ok=True)
-
-    return os.path.join(content_path, cache_path, "keyforge.cache.json")
-
-
-def get_dok_decks_cache_path(pelican):
-    cache_path = pelican.settings.get("DECKLOCK_CACHE", None)
-    content_path = get_content_path(pelican)
-
-    Path(content_path, cache_path).mkdir(parents=True, exist_ok=True)
-
-    return os.path.join(content_path, cache_path, "dok_decks.cache.json")
-
-
-def get_keyforge_assets_paths(pelican):
-    keyforge_assets_path = pelican.settings.get("KEYFORGE_ASSETS_PATH", None)
-    content_path = get_content_path(pelican)
-
-    keyforge_assets_house_image_directory = os.path.join(
-        content_path, keyforge_assets_path, "houses"
-    )
-    keyforge_assets_card_image_directory = os.path.join(
-        content_path, keyforge_assets_path, "cards"
-    )
-
-    Path(keyforge_assets_house_image_directory).mkdir(parents=True, exist_ok=True)
-    Path(keyforge_assets_card_image_directory).mkdir(parents=True, exist_ok=True)
-
-    return keyforge_assets_house_image_directory, keyforge_assets_card_image_directory
-
-
-def get_dok_data(deck_id, api_key):
-    if api_key is None:
-        return {}
-
-    api_headers = {"Api-Key": api_key}
-    r = requests.get(
-        f"https://decksofkeyforge.com/public-api/v3/decks/{deck_id}",
-        headers=api_headers,
-    )
-
-    if r.status_code != 200:
-        print(f"Warning: DoK API failed for deck {deck_id}: HTTP {r.status_code}")
-        return {}
-
-    return r.json()
-
-
-def get_dok_deck_stats(api_key):
-    if api_key is None:
-        return {}
-
-    api_headers = {"Api-Key": api_key}
-    r = requests.get(
-        "https://decksofkeyforge.com/public-api/v1/stats",
-        headers=api_headers,
-    )
-
-    if r.status_code != 200:
-        print(f"Warning: DoK stats API failed: HTTP {r.status_code}")
-        return {}
-
-    return r.json()
-
-
-def get_vault_data(deck_id):
-    r = requests.get(
-        f"https://www.keyforgegame.com/api/decks/{deck_id}/?links=cards,notes"
-    )
-
-    return r.json()
-
-
-def get_keyforge_assets(generator, decks_data):
-    house_dir_path, card_img_dir_path = get_keyforge_assets_paths(generator)
-    download_images = not generator.settings.get("USE_EXTERNAL_LINKS", True)
-
-    for k, v in decks_data.items():
-        cards = v["vault_data"]["_linked"]["cards"]
-
-        for card in cards:
-            img_url = card["front_image"]
-            img_filename = Path(urlparse(img_url).path).name
-            img_file_path = os.path.join(card_img_dir_path, img_filename)
-            if download_images:
-                fetch_image(img_url, img_file_path)
-
-        houses = v["vault_data"]["_linked"]["houses"]
-        for house in houses:
-            img_url = house["image"]
-            img_filename = Path(urlparse(img_url).path).name
-            img_file_path = os.path.join(house_dir_path, img_filename)
-            if download_images:
-                fetch_image(img_url, img_file_path)
-
-
-def parse_dok_stats(dok_data, dok_decks_data):
-    """
-    The data for a single deck, needs to be compared to summary statistics for all decks in DoK
-
-    :param dok_data: the deck data
-    :param dok_decks_data: summary statistics for all decks
-    :return: dict with stats comparing the current deck to all decks in DoK
-    """
-    fields = [
-        "expectedAmber",
-        "creatureProtection",
-        "amberControl",
-        "artifactControl",
-        "creatureControl",
-        "effectivePower",
-        "disruption",
-        "efficiency",
-        "recursion",
-    ]
-
-    output = {}
-
-    for f in fields:
-        try:
-            output[f] = dok_decks_data[f + "Stats"]["percentileForValue"][
-                str(round(dok_data["deck"].get(f, 0)))
-            ]
-        except (KeyError, ValueError, TypeError):
-            output[f] = 0
-
-    return output
-
-
-def get_keyforge_external_data(generator):
-    data = get_keyforge_data(generator)
-    dok_api_key = generator.settings.get("DOK_API_KEY", None)
-
-    keyforge_cache_path = get_keyforge_cache_path(generator)
-
-    # To avoid hammering APIs relentlessly data is cached, if data is available, load here
-    if os.path.exists(keyforge_cache_path):
-        with open(keyforge_cache_path, "r") as fin:
-            current_data = json.load(fin)
-    else:
-        current_data = {}
-
-    dok_decks_cache_path = get_dok_decks_cache_path(generator)
-    if os.path.exists(dok_decks_cache_path):
-        with open(dok_decks_cache_path, "r") as fin:
-            current_dok_deck_data = json.load(fin)
-    else:
-        current_dok_deck_data = get_dok_deck_stats(dok_api_key)
-        with open(dok_decks_cache_path, "w") as fout:
-            json.dump(
-                current_dok_deck_data,
-                fout,
-                sort_keys=True,
-                indent=4,
-                separators=(",", ": "),
-            )
-
-    for deck in data:
-        if deck["deck_id"] not in current_data.keys():
-            print(f"Fetching data for KeyForge deck {deck['deck_id']}")
-            dok_data = get_dok_data(deck["deck_id"], dok_api_key)
-            vault_data = get_vault_data((deck["deck_id"]))
-
-            current_data[deck["deck_id"]] = {
-                "dok_data": dok_data if dok_data else {},
-                "vault_data": vault_data,
-            }
-
-        # Add DoK Stats (percentiles) - only if we have dok_data
-        if current_data[deck["deck_id"]]["dok_data"]:
-            current_data[deck["deck_id"]]["dok_stats"] = parse_dok_stats(
-                current_data[deck["deck_id"]]["dok_data"], current_dok_deck_data
-            )
-        else:
-            current_data[deck["deck_id"]]["dok_stats"] = {}
-
-        # update user data
-        current_data[deck["deck_id"]]["user_data"] = deck
-        current_data[deck["deck_id"]]["adventure_data"] = {
-            "defeated_keyraken": deck.get("defeated_keyraken", False),
-            "keyraken_difficulty": deck.get("keyraken_difficulty", False),
-            "defeated_conspiracy": deck.get("defeated_conspiracy", False),
-            "conspiracy_difficulty": deck.get("conspiracy_difficulty", False),
-        }
-
-    with open(keyforge_cache_path, "w") as fout:
-        json.dump(current_data, fout, sort_keys=True, indent=4, separators=(",", ": "))
-
-    # Get image data
-    get_keyforge_assets(generator, current_data)
-
-    generator.settings["KEYFORGE_DECK_COUNT"] = len(current_data.values())
-
-
-def get_generators(generators):
-    return KeyForgeGenerator
-
-
-def register():
-    """Register new functions"""
-    signals.initialized.connect(get_keyforge_external_data)
-    signals.get_generators.connect(get_generators)
+import os
+import json
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pelican import signals
+from pathlib import Path
+from urllib.parse import urlparse
+
+from plugins.cache import flush_caches, open_cache
+from plugins.keyforge.cards import get_deck_cards, split_deck_cards
+from plugins.keyforge.generator import KeyForgeGenerator
+from plugins.images import download_images, generate_derivatives, queue_image
+from plugins.utils import http_client
+
+DOK_API = "https://decksofkeyforge.com/public-api"
+VAULT_API = "https://www.keyforgegame.com/api"
+
+
+def get_content_path(pelican):
+    return pelican.settings.get("PATH")
+
+
+def get_keyforge_data(pelican):
+    keyforge_path = pelican.settings.get("KEYFORGE_PATH", None)
+
+    if keyforge_path is None:
+        return []
+
+    content_path = get_content_path(pelican)
+
+    input_path = os.path.join(content_path, keyforge_path, "keyforge.json")
+    with open(input_path, "r") as fin:
+        output = json.load(fin)
+
+    return output
+
+
+def get_keyforge_assets_paths(pelican):
+    keyforge_assets_path = pelican.settings.get("KEYFORGE_ASSETS_PATH", None)
+    content_path = get_content_path(pelican)
+
+    keyforge_assets_house_image_directory = os.path.join(
+        content_path, keyforge_assets_path, "houses"
+    )
+    keyforge_assets_card_image_directory = os.path.join(
+        content_path, keyforge_assets_path, "cards"
+    )
+
+    Path(keyforge_assets_house_image_directory).mkdir(parents=True, exist_ok=True)
+    Path(keyforge_assets_card_image_directory).mkdir(parents=True, exist_ok=True)
+
+    return keyforge_assets_house_image_directory, keyforge_assets_card_image_directory
+
+
+def get_dok_data(deck_id, api_key, api_url=DOK_API):
+    if api_key is None:
+        return {}
+
+    api_headers = {"Api-Key": api_key}
+    r = http_client.get(
+        f"{api_url}/v3/decks/{deck_id}",
+        headers=api_headers,
+    )
+
+    if r.status_code != 200:
+        print(f"Warning: DoK API failed for deck {deck_id}: HTTP {r.status_code}")
+        return {}
+
+    return r.json()
+
+
+def get_dok_deck_stats(api_key, api_url=DOK_API):
+    if api_key is None:
+        return {}
+
+    api_headers = {"Api-Key": api_key}
+    r = http_client.get(
+        f"{api_url}/v1/stats",
+        headers=api_headers,
+    )
+
+    if r.status_code != 200:
+        print(f"Warning: DoK stats API failed: HTTP {r.status_code}")
+        return {}
+
+    return r.json()
+
+
+def get_vault_data(deck_id, api_url=VAULT_API):
+    r = http_client.get(f"{api_url}/decks/{deck_id}/?links=cards,notes")
+
+    if r.status_code != 200:
+        print(f"Warning: Vault API failed for deck {deck_id}: HTTP {r.status_code}")
+        return None
+
+    return r.json()
+
+
+def fetch_decks_data(settings, current_data, deck_ids):
+    """
+    Fetch the data of new decks from DoK and the Vault, using a pool of KEYFORGE_FETCH_WORKERS threads with both calls
+    for a deck running in parallel. Rate limits and retries are handled by the shared http client. The cache is
+    written every KEYFORGE_CHECKPOINT decks and when the build is interrupted (Ctrl-C), so an interrupted run
+    continues where it left off. Decks that can't be fetched from the Vault are skipped and fetched again on the next
+    build. The cards of the decks are added to the shared card table (see split_deck_cards).
+
+    :param settings: pelican settings
+    :param current_data: keyforge cache to add the decks to
+    :param deck_ids: ids of the decks to fetch
+    """
+    if len(deck_ids) == 0:
+        return
+
+    dok_api_key = settings.get("DOK_API_KEY", None)
+    dok_api_url = settings.get("KEYFORGE_DOK_API", DOK_API)
+    vault_api_url = settings.get("KEYFORGE_VAULT_API", VAULT_API)
+    workers = settings.get("KEYFORGE_FETCH_WORKERS", 8)
+    checkpoint = settings.get("KEYFORGE_CHECKPOINT", 10)
+    cards_cache = open_cache(settings, "keyforge_cards")
+
+    print(f"Fetching data for {len(deck_ids)} KeyForge decks")
+    fetched = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for deck_id in deck_ids:
+            dok_future = executor.submit(
+                get_dok_data, deck_id, dok_api_key, dok_api_url
+            )
+            vault_future = executor.submit(get_vault_data, deck_id, vault_api_url)
+            futures[vault_future] = (deck_id, dok_future)
+
+        try:
+            for vault_future in as_completed(futures.keys()):
+                deck_id, dok_future = futures[vault_future]
+                try:
+                    vault_data = vault_future.result()
+                    dok_data = dok_future.result()
+                except Exception as e:
+                    print(f"Warning: could not fetch KeyForge deck {deck_id}: {e}")
+                    continue
+
+                if vault_data is None:
+                    continue
+
+                deck_data = {
+                    "dok_data": dok_data if dok_data else {},
+                    "vault_data": vault_data,
+                }
+                current_data.set((deck_id,), split_deck_cards(deck_data, cards_cache))
+
+                fetched += 1
+                if fetched % checkpoint == 0:
+                    print(f"Fetched {fetched} of {len(deck_ids)} KeyForge decks")
+                    # Cards first, so the decks written never refer to cards that aren't
+                    cards_cache.flush()
+                    current_data.flush()
+        except KeyboardInterrupt:
+            # Keep the decks fetched so far and don't start the requests that are still queued
+            print(f"Interrupted, saving {fetched} fetched KeyForge decks")
+            cards_cache.flush()
+            current_data.flush()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def get_keyforge_assets(generator, decks_data):
+    house_dir_path, card_img_dir_path = get_keyforge_assets_paths(generator)
+    download_images = not generator.settings.get("USE_EXTERNAL_LINKS", True)
+    cards_cache = open_cache(generator.settings, "keyforge_cards")
+
+    for k, v in decks_data:
+        cards = get_deck_cards(v, cards_cache)
+
+        for card in cards:
+            if card is None:
+                continue
+
+            img_url = card["front_image"]
+            img_filename = Path(urlparse(img_url).path).name
+            img_file_path = os.path.join(card_img_dir_path, img_filename)
+            if download_images:
+                queue_image(img_url, img_file_path)
+
+        houses = v["vault_data"]["_linked"]["houses"]
+        for house in houses:
+            img_url = house["image"]
+            img_filename = Path(urlparse(img_url).path).name
+            img_file_path = os.path.join(house_dir_path, img_filename)
+            if download_images:
+                queue_image(img_url, img_file_path)
+
+
+DOK_STATS_FIELDS = [
+    "expectedAmber",
+    "creatureProtection",
+    "amberControl",
+    "artifactControl",
+    "creatureControl",
+    "effectivePower",
+    "disruption",
+    "efficiency",
+    "recursion",
+]
+
+
+def compile_dok_stats(dok_decks_data, fetched):
+    """
+    Compile DoK's summary statistics for all decks into compact tables with the values (sorted) and their percentiles,
+    only for the fields in DOK_STATS_FIELDS
+
+    :param dok_decks_data: summary statistics for all decks, as returned by DoK's stats API
+    :param fetched: time the statistics were fetched
+    :return: dict with a table for each field
+    """
+    output = {}
+
+    for f in DOK_STATS_FIELDS:
+        percentile_for_value = dok_decks_data.get(f + "Stats", {}).get(
+            "percentileForValue", {}
+        )
+        table = sorted((float(k), v) for k, v in percentile_for_value.items())
+
+        output[f] = {
+            "values": [v for v, _ in table],
+            "percentiles": [p for _, p in table],
+            "fetched": fetched,
+        }
+
+    return output
+
+
+def get_dok_stats_tables(settings):
+    """
+    Get the percentile tables of the DoK stats, these are fetched again when they are older than DOK_STATS_TTL days
+
+    :param settings: pelican settings
+    :return: dict with a table for each field in DOK_STATS_FIELDS
+    """
+    dok_stats_cache = open_cache(settings, "dok_stats")
+    tables = {f: dok_stats_cache.get((f,)) for f in DOK_STATS_FIELDS}
+
+    if any(t is None for t in tables.values()):
+        # Statistics cached by older versions are compiled rather than fetched again
+        dok_decks_cache = open_cache(settings, "dok_decks")
+        if not dok_decks_cache.is_empty():
+            legacy_data = {
+                f + "Stats": dok_decks_cache.get((f + "Stats",), {})
+                for f in DOK_STATS_FIELDS
+            }
+            tables = compile_dok_stats(legacy_data, 0)
+
+    ttl = settings.get("DOK_STATS_TTL", 30) * 24 * 60 * 60
+    fetched = min(t["fetched"] if t is not None else 0 for t in tables.values())
+
+    if time.time() - fetched > ttl:
+        dok_decks_data = get_dok_deck_stats(
+            settings.get("DOK_API_KEY", None),
+            settings.get("KEYFORGE_DOK_API", DOK_API),
+        )
+        if dok_decks_data:
+            print("Updated DoK stats")
+            tables = compile_dok_stats(dok_decks_data, time.time())
+
+    for f, table in tables.items():
+        if table is not None and table != dok_stats_cache.get((f,)):
+            dok_stats_cache.set((f,), table)
+
+    return tables
+
+
+def get_percentiles(table, values):
+    """
+    Look up the percentiles of many values at once: the values are sorted and matched against the sorted table in a
+    single pass. Values not in the table are interpolated between the closest values that are.
+
+    :param table: percentile table of a field (see compile_dok_stats)
+    :param values: list of values
+    :return: list with the percentile of each value
+    """
+    table_values = table["values"] if table is not None else []
+    percentiles = table["percentiles"] if table is not None else []
+    output = [0] * len(values)
+
+    if len(table_values) == 0:
+        return output
+
+    j = 0
+    for i in sorted(range(len(values)), key=lambda ix: values[ix]):
+        value = values[i]
+        j = bisect_left(table_values, value, j)
+
+        if j < len(table_values) and table_values[j] == value:
+            output[i] = percentiles[j]
+        elif j == 0:
+            output[i] = percentiles[0]
+        elif j == len(table_values):
+            output[i] = percentiles[-1]
+        else:
+            low, high = table_values[j - 1], table_values[j]
+            fraction = (value - low) / (high - low)
+            output[i] = percentiles[j - 1] + fraction * (
+                percentiles[j] - percentiles[j - 1]
+            )
+
+    return output
+
+
+def parse_dok_stats(decks_dok_data, tables):
+    """
+    The data for each deck, needs to be compared to summary statistics for all decks in DoK
+
+    :param decks_dok_data: list with the DoK data of each deck
+    :param tables: percentile tables for all decks (see get_dok_stats_tables)
+    :return: list with a dict for each deck, with stats comparing it to all decks in DoK
+    """
+    output = [{} for _ in decks_dok_data]
+
+    for f in DOK_STATS_FIELDS:
+        values = []
+        for dok_data in decks_dok_data:
+            try:
+                values.append(round(dok_data["deck"].get(f, 0)))
+            except (KeyError, ValueError, TypeError):
+                values.append(None)
+
+        # Decks with an invalid value get a percentile of 0
+        valid = [ix for ix, v in enumerate(values) if v is not None]
+        percentiles = get_percentiles(tables.get(f), [values[ix] for ix in valid])
+
+        for stats in output:
+            stats[f] = 0
+        for ix, percentile in zip(valid, percentiles):
+            output[ix][f] = percentile
+
+    return output
+
+
+def get_keyforge_external_data(generator):
+    data = get_keyforge_data(generator)
+
+    # To avoid hammering APIs relentlessly data is cached
+    current_data = open_cache(generator.settings, "keyforge")
+    cards_cache = open_cache(generator.settings, "keyforge_cards")
+    dok_stats_tables = get_dok_stats_tables(generator.settings)
+
+    new_decks = []
+    for deck in data:
+        deck_data = current_data.get((deck["deck_id"],))
+
+        # Decks with cards missing from the card table are fetched again as well
+        if (
+            deck_data is None or None in get_deck_cards(deck_data, cards_cache)
+        ) and deck["deck_id"] not in new_decks:
+            new_decks.append(deck["deck_id"])
+
+    fetch_decks_data(generator.settings, current_data, new_decks)
+
+    cached_decks = [
+        (deck, current_data.get((deck["deck_id"],)))
+        for deck in data
+        if (deck["deck_id"],) in current_data
+    ]
+
+    # DoK Stats (percentiles) are computed for all decks with dok_data at once
+    dok_decks = [
+        deck_data["dok_data"] for _, deck_data in cached_decks if deck_data["dok_data"]
+    ]
+    dok_stats = iter(parse_dok_stats(dok_decks, dok_stats_tables))
+
+    for deck, deck_data in cached_decks:
+        # Decks cached by older versions hold a copy of each card, these are moved to the card table
+        updated_data = split_deck_cards(deck_data, cards_cache)
+        updated_data["dok_stats"] = next(dok_stats) if deck_data["dok_data"] else {}
+
+        # update user data
+        updated_data["user_data"] = deck
+        updated_data["adventure_data"] = {
+            "defeated_keyraken": deck.get("defeated_keyraken", False),
+            "keyraken_difficulty": deck.get("keyraken_difficulty", False),
+            "defeated_conspiracy": deck.get("defeated_conspiracy", False),
+            "conspiracy_difficulty": deck.get("conspiracy_difficulty", False),
+        }
+
+        # Only changed decks are updated, so the cache isn't written when nothing changed
+        if updated_data != deck_data:
+            current_data.set((deck["deck_id"],), updated_data)
+
+    # The generator renders the decks from this same cache, which is only loaded once per build
+    decks = list(current_data.items())
+
+    # Get image data
+    get_keyforge_assets(generator, decks)
+
+    generator.settings["KEYFORGE_DECK_COUNT"] = len(decks)
+
+
+def get_generators(generators):
+    return KeyForgeGenerator
+
+
+def register():
+    """Register new functions"""
+    signals.initialized.connect(get_keyforge_external_data)
+    signals.get_generators.connect(get_generators)
+    signals.article_generator_finalized.connect(download_images)
+    signals.article_generator_finalized.connect(generate_derivatives)
+    signals.finalized.connect(flush_caches)
@@ -0,0 +1 @@
+from .minify import register as register
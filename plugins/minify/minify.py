@@ -0,0 +1,316 @@
+import gzip
+import hashlib
+import json
+import os
+import posixpath
+import re
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from cssmin import cssmin
+from pelican import signals
+
+from plugins.utils import write_json
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    from rjsmin import jsmin
+except ImportError:
+    jsmin = None
+
+OUTPUT_MANIFEST = "output_files.json"
+
+# Increase when the output of process_file changes, so all files are processed again
+MINIFY_VERSION = 1
+
+MINIFY_EXTENSIONS = [".html", ".css", ".js"]
+COMPRESS_EXTENSIONS = MINIFY_EXTENSIONS + [
+    ".json",
+    ".svg",
+    ".txt",
+    ".webmanifest",
+    ".xml",
+]
+COMPRESS_FORMATS = [".gz", ".br"]
+
+# Comments, elements whose content is kept as is and tags, text between these is collapsed
+HTML_TOKENS = re.compile(
+    r"<!--.*?-->"
+    r"|<(pre|textarea|script|style)\b.*?</\1\s*>"
+    r"|<[a-zA-Z/!](?:\"[^\"]*\"|'[^']*'|[^\"'>])*>",
+    re.I | re.S,
+)
+# Only HTML's whitespace characters, a non-breaking space is kept
+TAG_WHITESPACE = re.compile(r"(\"[^\"]*\"|'[^']*')|[ \t\n\f\r]+(?=>$)|([ \t\n\f\r]+)")
+WHITESPACE = re.compile(r"[ \t\n\f\r]+")
+
+
+def collapse_whitespace(match):
+    """Whitespace is replaced by a single newline or space, which is rendered the same"""
+    return "\n" if "\n" in match.group(0) else " "
+
+
+def collapse_tag_whitespace(match):
+    """Whitespace between attributes is replaced by a single space and removed before the end of the tag"""
+    if match.group(1) is not None:
+        return match.group(1)
+
+    return " " if match.group(2) is not None else ""
+
+
+def minify_html(text):
+    """
+    Remove comments (except conditional comments) and collapse whitespace in text and tags, attribute values and the
+    content of pre, textarea, script and style elements are left unchanged.
+    """
+    output = []
+    position = 0
+    for match in HTML_TOKENS.finditer(text):
+        output.append(
+            WHITESPACE.sub(collapse_whitespace, text[position : match.start()])
+        )
+        token = match.group(0)
+        if token.startswith("<!--"):
+            if token.startswith("<!--[if"):
+                output.append(token)
+        elif match.group(1) is not None:
+            output.append(token)
+        else:
+            output.append(TAG_WHITESPACE.sub(collapse_tag_whitespace, token))
+        position = match.end()
+
+    output.append(WHITESPACE.sub(collapse_whitespace, text[position:]))
+
+    return "".join(output)
+
+
+def minify(data, extension):
+    """:return: minified data (bytes), files that are minified already (.min.js) or can't be minified are unchanged"""
+    if extension == ".html":
+        return minify_html(data.decode("utf-8")).encode("utf-8")
+
+    if extension == ".css":
+        return cssmin(data.decode("utf-8")).encode("utf-8")
+
+    if extension == ".js" and jsmin is not None:
+        return jsmin(data.decode("utf-8")).encode("utf-8")
+
+    return data
+
+
+def compress(data, compress_format):
+    if compress_format == ".gz":
+        # Without a timestamp, so the same data always gives the same file
+        return gzip.compress(data, compresslevel=9, mtime=0)
+
+    return brotli.compress(data)
+
+
+def process_file(source_path, cache_base, extension, minify_file, compress_formats):
+    """
+    Minify and compress an output file, the results are written to the cache (cache_base + .min for the minified file,
+    + .gz and + .br for the compressed versions). These aren't named after the file, so Pelican doesn't read them.
+
+    :return: list of the compressed formats created (these are only kept when smaller) or None if the file could not be
+             processed
+    """
+    try:
+        with open(source_path, "rb") as fin:
+            data = fin.read()
+
+        if minify_file:
+            data = minify(data, extension)
+
+        files = {".min": data}
+        for compress_format in compress_formats:
+            compressed = compress(data, compress_format)
+            if len(compressed) < len(data):
+                files[compress_format] = compressed
+
+        for suffix, content in files.items():
+            tmp_path = f"{cache_base}{suffix}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as fout:
+                fout.write(content)
+            os.replace(tmp_path, cache_base + suffix)
+    except Exception as e:
+        print(f"Warning: could not minify or compress {source_path}: {e}")
+        return None
+
+    return [suffix for suffix in files.keys() if suffix != ".min"]
+
+
+def get_data_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_minify_config(settings):
+    """
+    :return: dict with the processing done to output files, set with DECKLOCK_MINIFY and DECKLOCK_PRECOMPRESS
+    """
+    compress_formats = [
+        f".{f.lstrip('.')}" for f in settings.get("DECKLOCK_PRECOMPRESS", [])
+    ]
+    for compress_format in compress_formats:
+        if compress_format not in COMPRESS_FORMATS:
+            print(f"Warning: unknown DECKLOCK_PRECOMPRESS format {compress_format}")
+
+    if ".br" in compress_formats and brotli is None:
+        print("Warning: Brotli is not installed, .br files are not created")
+
+    return {
+        "minify": settings.get("DECKLOCK_MINIFY", False),
+        "compress": [
+            f
+            for f in COMPRESS_FORMATS
+            if f in compress_formats and (f != ".br" or brotli is not None)
+        ],
+        "jsmin": jsmin is not None,
+        "version": MINIFY_VERSION,
+    }
+
+
+def get_output_files(output_path):
+    """:return: paths (relative to output_path) of all files that can be minified or compressed"""
+    files = []
+    for root, _, filenames in os.walk(output_path):
+        for filename in filenames:
+            if os.path.splitext(filename)[1] in COMPRESS_EXTENSIONS:
+                path = os.path.relpath(os.path.join(root, filename), output_path)
+                files.append(Path(path).as_posix())
+
+    return sorted(files)
+
+
+def remove_stale_files(output_path, keep):
+    """Remove compressed files in the output that are no longer up-to-date, or of which the original was removed"""
+    for root, _, filenames in os.walk(output_path):
+        for filename in filenames:
+            path = os.path.join(root, filename)
+            base, compress_format = os.path.splitext(path)
+            if (
+                compress_format in COMPRESS_FORMATS
+                and os.path.splitext(base)[1] in COMPRESS_EXTENSIONS
+                and Path(os.path.relpath(path, output_path)).as_posix() not in keep
+            ):
+                os.remove(path)
+
+
+def minify_output(pelican):
+    """
+    Minify the HTML, CSS and JS files in the output (DECKLOCK_MINIFY) and add gzip and/or Brotli compressed copies
+    (DECKLOCK_PRECOMPRESS = ["gz", "br"]) for hosts that serve these directly, using a pool of DECKLOCK_WORKERS
+    processes. The results are stored in the cache by hash of the file Pelican wrote, so only new or changed files are
+    processed again.
+    """
+    settings = pelican.settings
+    if not settings.get("DECKLOCK_MINIFY", False) and not settings.get(
+        "DECKLOCK_PRECOMPRESS", []
+    ):
+        return
+
+    config = get_minify_config(settings)
+    config_hash = get_data_hash(json.dumps(config, sort_keys=True).encode("utf-8"))
+
+    cache_path = posixpath.join(
+        settings.get("PATH"), settings.get("DECKLOCK_CACHE"), "output"
+    )
+    Path(cache_path).mkdir(parents=True, exist_ok=True)
+    manifest_path = posixpath.join(
+        settings.get("PATH"), settings.get("DECKLOCK_CACHE"), OUTPUT_MANIFEST
+    )
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, "r") as fin:
+            manifest = json.load(fin)
+
+    output = {}
+    jobs = []
+    for path in get_output_files(pelican.output_path):
+        output_file = os.path.join(pelican.output_path, path)
+        with open(output_file, "rb") as fin:
+            file_hash = get_data_hash(fin.read())
+
+        entry = manifest.get(path, {})
+        if (
+            entry.get("hash") == file_hash
+            and entry.get("config") == config_hash
+            and all(os.path.exists(output_file + f) for f in entry["compressed"])
+        ):
+            # Processed by an earlier build and not written again since
+            output[path] = entry
+            continue
+
+        extension = os.path.splitext(path)[1]
+        key = get_data_hash(f"{config_hash}:{file_hash}".encode("utf-8"))
+        cache_base = posixpath.join(cache_path, key)
+        if not os.path.exists(cache_base + ".min"):
+            minify_file = (
+                config["minify"]
+                and extension in MINIFY_EXTENSIONS
+                and not path.endswith((".min.css", ".min.js"))
+            )
+            jobs.append((path, key, extension, minify_file))
+        else:
+            output[path] = {"key": key}
+
+    if len(jobs) > 0:
+        workers = settings.get("DECKLOCK_WORKERS", 1)
+        print(f"Minifying and compressing {len(jobs)} output files")
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(
+                process_file,
+                [os.path.join(pelican.output_path, j[0]) for j in jobs],
+                [posixpath.join(cache_path, j[1]) for j in jobs],
+                [j[2] for j in jobs],
+                [j[3] for j in jobs],
+                [config["compress"]] * len(jobs),
+            )
+
+            for (path, key, _, _), compressed in zip(jobs, results):
+                if compressed is not None:
+                    output[path] = {"key": key, "compressed": compressed}
+
+    keys = set()
+    for path, entry in output.items():
+        keys.add(entry["key"])
+        if "hash" in entry.keys():
+            continue
+
+        # Copy the results from the cache to the output
+        cache_base = posixpath.join(cache_path, entry["key"])
+        if "compressed" not in entry.keys():
+            entry["compressed"] = [
+                f for f in config["compress"] if os.path.exists(cache_base + f)
+            ]
+
+        output_file = os.path.join(pelican.output_path, path)
+        shutil.copyfile(cache_base + ".min", output_file)
+        for compress_format in entry["compressed"]:
+            shutil.copyfile(cache_base + compress_format, output_file + compress_format)
+
+        with open(output_file, "rb") as fin:
+            entry["hash"] = get_data_hash(fin.read())
+        entry["config"] = config_hash
+
+    remove_stale_files(
+        pelican.output_path,
+        {path + f for path, entry in output.items() for f in entry["compressed"]},
+    )
+
+    # Results that weren't used by this build are removed from the cache
+    for filename in os.listdir(cache_path):
+        if filename.split(".")[0] not in keys:
+            os.remove(posixpath.join(cache_path, filename))
+
+    if output != manifest:
+        write_json(output, manifest_path)
+
+
+def register():
+    signals.finalized.connect(minify_output)
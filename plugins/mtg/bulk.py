@@ -0,0 +1,107 @@
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+from plugins.utils import iter_json_array
+
+
+def get_card_names(card):
+    names = [card["name"]]
+    for face in card.get("card_faces", []):
+        if face.get("name") and face["name"] not in names:
+            names.append(face["name"])
+
+    return names
+
+
+class ScryfallBulkIndex:
+    """On-disk (set, name) index of a Scryfall bulk data file"""
+
+    def __init__(self, bulk_path, index_path):
+        self.bulk_path = bulk_path
+        self.index_path = index_path
+        self.connection = None
+
+    @property
+    def bulk_signature(self):
+        stat = os.stat(self.bulk_path)
+        return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+    def open(self):
+        """Open the index, (re)building it when the bulk data file changed since it was last indexed"""
+        if self.connection is not None:
+            return
+
+        Path(self.index_path).parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.index_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+        )
+
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = 'bulk_signature'"
+        ).fetchone()
+
+        if row is None or row[0] != self.bulk_signature:
+            self.build()
+
+    def build(self):
+        print(f"Indexing Scryfall bulk data {self.bulk_path}")
+        signature = self.bulk_signature
+
+        with self.connection:
+            self.connection.execute("DROP TABLE IF EXISTS cards")
+            self.connection.execute(
+                "CREATE TABLE cards ("
+                "card_set TEXT, card_name TEXT, released_at TEXT, data TEXT, "
+                "PRIMARY KEY (card_set, card_name))"
+            )
+
+            count = 0
+            for card in iter_json_array(self.bulk_path):
+                if card.get("lang", "en") != "en":
+                    continue
+
+                data = json.dumps(card)
+                card_set = card.get("set", "").lower()
+                for name in get_card_names(card):
+                    self.connection.execute(
+                        "INSERT OR IGNORE INTO cards VALUES (?, ?, ?, ?)",
+                        (card_set, name.lower(), card.get("released_at", ""), data),
+                    )
+                count += 1
+
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS cards_by_name ON cards (card_name, released_at)"
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('bulk_signature', ?)", (signature,)
+            )
+
+        print(f"Indexed {count} cards from Scryfall bulk data")
+
+    def get(self, card_set, card_name):
+        """
+        Look up a card by set and name, if the set is empty the most recent printing is returned (as the Scryfall API
+        would do). A card that isn't in the requested set isn't found, like with the API, so it is handled the same way
+        whether the bulk data is used or not.
+
+        :param card_set: set code as used in the deck file (case-insensitive), can be empty
+        :param card_name: name of the card (case-insensitive)
+        :return: the card's data or None if it is not in the bulk data
+        """
+        self.open()
+
+        if card_set:
+            row = self.connection.execute(
+                "SELECT data FROM cards WHERE card_set = ? AND card_name = ?",
+                (card_set.lower(), card_name.lower()),
+            ).fetchone()
+        else:
+            row = self.connection.execute(
+                "SELECT data FROM cards WHERE card_name = ? ORDER BY released_at DESC LIMIT 1",
+                (card_name.lower(),),
+            ).fetchone()
+
+        return json.loads(row[0]) if row is not None else None
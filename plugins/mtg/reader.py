@@ -1,270 +1,445 @@
-from pelican import signals
-from pelican.readers import BaseReader
-
-import json
-import os
-import posixpath
-from pathlib import Path
-from urllib.parse import urlparse
-from urllib.parse import quote
-import requests
-from time import sleep
-from collections import defaultdict, Counter
-
-from plugins.utils import fetch_image, get_last_modified
-from pelican.utils import slugify
-
-cmc_distribution_colors = {
-    "B": ("rgba(186, 177, 171, 0.9)", "rgba(186, 177, 171, 1)"),
-    "W": ("rgba(248, 246, 216, 0.9)", "rgba(248, 246, 216, 1)"),
-    "G": ("rgba(163, 192, 149, 0.9)", "rgba(163, 192, 149, 1)"),
-    "R": ("rgba(228, 153, 119, 0.9)", "rgba(228, 153, 119, 1)"),
-    "U": ("rgba(193, 215, 233, 0.9)", "rgba(193, 215, 233, 1)"),
-    "A": ("rgba(157, 134, 96, 0.9)", "rgba(157, 134, 96, 1)"),
-    "M": ("rgba(194, 198, 107, 0.9)", "rgba(194, 198, 107, 1)"),
-}
-
-
-def get_local_card_img_path(assets_cards_path, url):
-    img_filename = Path(urlparse(url).path).name
-    return posixpath.join(assets_cards_path, img_filename)
-
-
-def parse_meta(line):
-    stripped_line = line.lstrip("//").strip()
-    tag, value = [p.strip() for p in stripped_line.split(":")]
-
-    return tag, value
-
-
-def parse_card_line(line):
-    sideboard = False
-
-    stripped_line = line.strip()
-
-    if stripped_line.startswith("SB:"):
-        sideboard = True
-        stripped_line = stripped_line.lstrip("SB:").strip()
-
-    card_count, card_set, card_name = stripped_line.split(" ", 2)
-
-    card_set = card_set.replace("[", "").replace("]", "")
-
-    return sideboard, card_set, int(card_count), card_name
-
-
-def get_card_data(card_set, card_name, sleep_time=0.1):
-    card_name_attribute = quote(card_name)
-    if card_set == "" or card_set is None:
-        r = requests.get(
-            f"https://api.scryfall.com/cards/named?fuzzy={card_name_attribute}"
-        )
-    else:
-        r = requests.get(
-            f"https://api.scryfall.com/cards/named?fuzzy={card_name_attribute}&set={card_set}"
-        )
-    sleep(sleep_time)
-    return r.json()
-
-
-def parse_card_type(type_line):
-    if " — " in type_line:
-        p = type_line.split(" — ")[0]
-    else:
-        p = type_line
-
-    parts = p.split()
-
-    return parts[-1].lower()
-
-
-def build_stacks(deck_data, stack_size=4):
-    output_stacks = []
-    current_stack = []
-    for ix, card in enumerate(deck_data):
-        for _ in range(card["count"]):
-            current_stack.append(ix)
-            if len(current_stack) == stack_size:
-                output_stacks.append(current_stack.copy())
-                current_stack = []
-    output_stacks.append(current_stack.copy())
-    return output_stacks
-
-
-class MTGReader(BaseReader):
-    enabled = True
-
-    file_extensions = ["mwDeck"]
-
-    def __init__(self, settings):
-        super(MTGReader, self).__init__(settings)
-
-        self.cached_data = {}
-
-        if os.path.exists(self.mtg_data_path):
-            with open(self.mtg_data_path, "r") as fin:
-                self.cached_data = json.load(fin)
-
-        Path(self.mtg_assets_cards_path(full=True)).mkdir(parents=True, exist_ok=True)
-
-    @property
-    def mtg_data_path(self):
-        Path(self.settings.get("PATH"), self.settings.get("DECKLOCK_CACHE")).mkdir(
-            parents=True, exist_ok=True
-        )
-
-        return posixpath.join(
-            self.settings.get("PATH"),
-            self.settings.get("DECKLOCK_CACHE"),
-            "mtg.cached_cards.json",
-        )
-
-    def write_cache(self):
-        with open(self.mtg_data_path, "w") as fout:
-            json.dump(
-                self.cached_data, fout, sort_keys=True, indent=4, separators=(",", ": ")
-            )
-
-    def mtg_assets_cards_path(self, full=False):
-        if full:
-            return posixpath.join(
-                self.settings.get("PATH"), self.settings.get("MTG_ASSETS_PATH"), "cards"
-            )
-        else:
-            return posixpath.join(self.settings.get("MTG_ASSETS_PATH"), "cards")
-
-    def add_card_data(self, card_set, card_name):
-        if card_set not in self.cached_data.keys():
-            self.cached_data[card_set] = {}
-        if card_name not in self.cached_data[card_set].keys():
-            card_data = get_card_data(card_set, card_name)
-            self.cached_data[card_set][card_name] = card_data
-        else:
-            card_data = self.cached_data[card_set][card_name]
-        try:
-            if "card_faces" in card_data.keys():
-                card_data.update(card_data["card_faces"][0])
-
-            img_url = card_data["image_uris"]["border_crop"]
-            local_path = get_local_card_img_path(
-                self.mtg_assets_cards_path(full=False), img_url
-            )
-            self.cached_data[card_set][card_name]["image_path"] = local_path
-
-            local_path_full = get_local_card_img_path(
-                self.mtg_assets_cards_path(full=True), img_url
-            )
-            if not self.settings.get("USE_EXTERNAL_LINKS", True):
-                fetch_image(img_url, local_path_full)
-        except (KeyError, ValueError, TypeError, OSError) as e:
-            print(f"an error occurred fetching {card_name} from set {card_set}: {e}")
-
-    def read(self, filename):
-        metadata = {
-            "category": "MTG_Deck",
-            "date": get_last_modified(filename),
-            "template": "mtg_deck",
-        }
-
-        deck_data = {"main": [], "sideboard": [], "colors": []}
-        description = []
-
-        cmc_per_color = defaultdict(list)
-
-        with open(filename, "r") as fin:
-            for line in fin:
-                if line.startswith("//"):
-                    tag, value = parse_meta(line)
-                    metadata[tag.lower()] = value
-                elif line.startswith("---"):
-                    # This is the description, read until end of file
-                    for dl in fin:
-                        description.append(dl.strip())
-                elif line.strip() != "":
-                    sideboard, card_set, card_count, card_name = parse_card_line(line)
-                    self.add_card_data(card_set, card_name)
-
-                    card_data = {
-                        "name": card_name,
-                        "count": card_count,
-                        "data": self.cached_data[card_set][card_name],
-                        "card_type": parse_card_type(
-                            self.cached_data[card_set][card_name]["type_line"]
-                        ),
-                    }
-
-                    for color in self.cached_data[card_set][card_name]["colors"]:
-                        if color not in deck_data["colors"]:
-                            deck_data["colors"].append(color)
-
-                    if sideboard:
-                        deck_data["sideboard"].append(card_data)
-                    else:
-                        deck_data["main"].append(card_data)
-
-                        if card_data["card_type"] != "land":
-                            card_colors = self.cached_data[card_set][card_name][
-                                "colors"
-                            ]
-                            num_colors = len(card_colors)
-                            card_cmc = min(
-                                11, int(self.cached_data[card_set][card_name]["cmc"])
-                            )
-
-                            if num_colors == 1:
-                                cmc_per_color[card_colors[0]].extend(
-                                    [card_cmc] * card_count
-                                )
-                            elif num_colors == 0:
-                                # Artifact and devoid cards
-                                cmc_per_color["A"].extend([card_cmc] * card_count)
-                            else:
-                                # Multicolor and hybrid cards
-                                cmc_per_color["M"].extend([card_cmc] * card_count)
-
-        cmc_distribution = {k: dict(Counter(v)) for k, v in cmc_per_color.items()}
-        for k in cmc_distribution.keys():
-            for i in range(0, 12):
-                if i not in cmc_distribution[k].keys():
-                    cmc_distribution[k][i] = 0
-
-        deck_data["colors_string"] = "".join(
-            ["{" + str(c).upper() + "}" for c in sorted(deck_data["colors"])]
-        )
-        deck_data["cmc_distribution"] = {
-            k: [a[1] for a in sorted(v.items())] for k, v in cmc_distribution.items()
-        }
-        deck_data["cmc_distribution_colors"] = cmc_distribution_colors
-
-        deck_data["main_stacks"] = build_stacks(deck_data["main"])
-        deck_data["sideboard_stacks"] = build_stacks(deck_data["sideboard"])
-
-        self.write_cache()
-
-        print(f"Adding MTG {metadata['name']}")
-        metadata["title"] = metadata["name"]
-        metadata["slug"] = slugify(
-            metadata["title"],
-            regex_subs=self.settings.get("SLUG_REGEX_SUBSTITUTIONS", []),
-        )
-
-        metadata["description"] = "\n".join(description)
-
-        metadata["url"] = f"mtg/{metadata['format']}/{metadata['slug']}/"
-        metadata["save_as"] = f"{metadata['url']}index.html"
-
-        parsed = {}
-        for key, value in metadata.items():
-            parsed[key] = self.process_metadata(key, value)
-
-        parsed["deck"] = deck_data
-
-        return "", parsed
-
-
-def add_reader(readers):
-    readers.reader_classes["mwDeck"] = MTGReader
-
-
-def register():
-    signals.readers_init.connect(add_reader)
+from pelican import signals
+from pelican.readers import BaseReader
+
+import json
+import posixpath
+from pathlib import Path
+from urllib.parse import urlparse
+from urllib.parse import quote
+from collections import defaultdict, Counter
+
+from plugins.cache import flush_caches, open_cache
+from plugins.failed_lookups import (
+    add_failed_lookup,
+    get_failed_lookup,
+    report_failed_lookups,
+)
+from plugins.mtg.bulk import ScryfallBulkIndex, get_card_names
+from plugins.images import download_images, generate_derivatives, queue_image
+from plugins.incremental import read_deck
+from plugins.parallel import CacheMiss, get_preparsed_deck, preparse_decks
+from plugins.records import DeckCard, MTGCard, freeze, intern
+from plugins.utils import (
+    get_last_modified,
+    http_client,
+    project_fields,
+)
+from pelican.utils import slugify
+
+cmc_distribution_colors = {
+    "B": ("rgba(186, 177, 171, 0.9)", "rgba(186, 177, 171, 1)"),
+    "W": ("rgba(248, 246, 216, 0.9)", "rgba(248, 246, 216, 1)"),
+    "G": ("rgba(163, 192, 149, 0.9)", "rgba(163, 192, 149, 1)"),
+    "R": ("rgba(228, 153, 119, 0.9)", "rgba(228, 153, 119, 1)"),
+    "U": ("rgba(193, 215, 233, 0.9)", "rgba(193, 215, 233, 1)"),
+    "A": ("rgba(157, 134, 96, 0.9)", "rgba(157, 134, 96, 1)"),
+    "M": ("rgba(194, 198, 107, 0.9)", "rgba(194, 198, 107, 1)"),
+}
+
+SCRYFALL_API = "https://api.scryfall.com"
+
+# Maximum number of identifiers Scryfall accepts in a single /cards/collection request
+SCRYFALL_COLLECTION_SIZE = 75
+
+# Fields of Scryfall's card objects that are used in the templates and deck statistics, only these are cached
+MTG_CARD_FIELDS = [
+    "name",
+    "set",
+    "type_line",
+    "mana_cost",
+    "cmc",
+    "colors",
+    "oracle_text",
+    "image_uris.border_crop",
+]
+
+
+def get_local_card_img_path(assets_cards_path, url):
+    img_filename = Path(urlparse(url).path).name
+    return posixpath.join(assets_cards_path, img_filename)
+
+
+def parse_meta(line):
+    stripped_line = line.lstrip("//").strip()
+    tag, value = [p.strip() for p in stripped_line.split(":")]
+
+    return tag, value
+
+
+def parse_card_line(line):
+    sideboard = False
+
+    stripped_line = line.strip()
+
+    if stripped_line.startswith("SB:"):
+        sideboard = True
+        stripped_line = stripped_line.lstrip("SB:").strip()
+
+    card_count, card_set, card_name = stripped_line.split(" ", 2)
+
+    card_set = card_set.replace("[", "").replace("]", "")
+
+    return sideboard, card_set, int(card_count), card_name
+
+
+def get_card_data(card_set, card_name, api_url=SCRYFALL_API):
+    card_name_attribute = quote(card_name)
+    if card_set == "" or card_set is None:
+        r = http_client.get(f"{api_url}/cards/named?fuzzy={card_name_attribute}")
+    else:
+        r = http_client.get(
+            f"{api_url}/cards/named?fuzzy={card_name_attribute}&set={card_set}"
+        )
+    return r.json()
+
+
+def match_collection_card(card, identifiers):
+    """
+    Find which of the requested (set, name) identifiers a card returned by /cards/collection belongs to. The name of
+    the returned card can differ from the requested one (e.g. a single face of a double faced card was requested).
+    """
+    card_names = [n.lower() for n in get_card_names(card)]
+    card_set = card.get("set", "").lower()
+
+    return [
+        (s, n)
+        for s, n in identifiers
+        if n.lower() in card_names and (not s or s.lower() == card_set)
+    ]
+
+
+def get_collection_data(
+    identifiers,
+    api_url=SCRYFALL_API,
+    batch_size=SCRYFALL_COLLECTION_SIZE,
+):
+    """
+    Look up many cards at once using Scryfall's /cards/collection endpoint
+
+    :param identifiers: list of (set, name) tuples, the set can be empty
+    :param api_url: base url of the Scryfall API
+    :param batch_size: number of cards to request at once
+    :return: dict with the card data for each (set, name) tuple that was found
+    """
+    output = {}
+
+    for i in range(0, len(identifiers), batch_size):
+        batch = identifiers[i : i + batch_size]
+        r = http_client.post(
+            f"{api_url}/cards/collection",
+            json={
+                "identifiers": [
+                    {"name": n, "set": s} if s else {"name": n} for s, n in batch
+                ]
+            },
+        )
+
+        if r.status_code != 200:
+            print(f"Warning: Scryfall collection request failed: HTTP {r.status_code}")
+            continue
+
+        for card in r.json().get("data", []):
+            for identifier in match_collection_card(card, batch):
+                output.setdefault(identifier, card)
+
+    return output
+
+
+def project_card_data(card_data, fields):
+    """
+    Reduce the card data returned by Scryfall to the fields DeckLock uses. For cards with multiple faces the front
+    face is used.
+
+    :param card_data: card object returned by Scryfall
+    :param fields: list of fields to keep (see project_fields), None to keep everything
+    :return: dict with the card's data
+    """
+    if card_data.get("object") == "error":
+        return card_data
+
+    if "card_faces" in card_data.keys():
+        card_data = dict(card_data, **card_data["card_faces"][0])
+
+    if fields is None:
+        return card_data
+
+    return project_fields(card_data, fields)
+
+
+def migrate_cached_cards(settings, cached_data, fields):
+    """
+    Reduce all entries cached before the fields were limited (or with other MTG_CARD_FIELDS). The fields the cache was
+    reduced to are stored in the signatures cache, so the entries are only read again when MTG_CARD_FIELDS changes. The
+    changes are written right away, so worker processes (see preparse_decks) read the migrated cache.
+    """
+    signature = json.dumps(fields)
+    signatures = open_cache(settings, "signatures")
+    if signatures.get(("mtg_card_fields",)) == signature:
+        return
+
+    for key, card_data in list(cached_data.items()):
+        projected_data = project_card_data(card_data, fields)
+        if projected_data != card_data:
+            cached_data.set(key, projected_data)
+
+    if cached_data.dirty:
+        print("Migrated cached MTG cards to MTG_CARD_FIELDS")
+        cached_data.flush()
+
+    signatures.set(("mtg_card_fields",), signature)
+    signatures.flush()
+
+
+def parse_card_type(type_line):
+    if " — " in type_line:
+        p = type_line.split(" — ")[0]
+    else:
+        p = type_line
+
+    parts = p.split()
+
+    return parts[-1].lower()
+
+
+def build_stacks(deck_data, stack_size=4):
+    output_stacks = []
+    current_stack = []
+    for ix, card in enumerate(deck_data):
+        for _ in range(card["count"]):
+            current_stack.append(ix)
+            if len(current_stack) == stack_size:
+                output_stacks.append(current_stack.copy())
+                current_stack = []
+    output_stacks.append(current_stack.copy())
+    return output_stacks
+
+
+class MTGReader(BaseReader):
+    enabled = True
+
+    file_extensions = ["mwDeck"]
+
+    def __init__(self, settings):
+        super(MTGReader, self).__init__(settings)
+
+        self.cached_data = open_cache(self.settings, "mtg")
+        self.cache_only = False
+        self.card_fields = self.settings.get("MTG_CARD_FIELDS", MTG_CARD_FIELDS)
+        self.bulk_index = None
+
+        migrate_cached_cards(self.settings, self.cached_data, self.card_fields)
+
+        if self.settings.get("MTG_SCRYFALL_BULK_DATA"):
+            self.bulk_index = ScryfallBulkIndex(
+                posixpath.join(
+                    self.settings.get("PATH"),
+                    self.settings.get("MTG_SCRYFALL_BULK_DATA"),
+                ),
+                posixpath.join(
+                    self.settings.get("PATH"),
+                    self.settings.get("DECKLOCK_CACHE"),
+                    "mtg.scryfall_bulk.sqlite",
+                ),
+            )
+
+        Path(self.mtg_assets_cards_path(full=True)).mkdir(parents=True, exist_ok=True)
+
+    def mtg_assets_cards_path(self, full=False):
+        if full:
+            return posixpath.join(
+                self.settings.get("PATH"), self.settings.get("MTG_ASSETS_PATH"), "cards"
+            )
+        else:
+            return posixpath.join(self.settings.get("MTG_ASSETS_PATH"), "cards")
+
+    def is_cached(self, card_set, card_name):
+        card_data = self.cached_data.get((card_set, card_name))
+
+        # Older versions cached Scryfall's error objects for cards that weren't found
+        return card_data is not None and card_data.get("object") != "error"
+
+    def fetch_cards_data(self, identifiers):
+        """
+        Add all (set, name) identifiers that are not cached yet to the cache. Cards are looked up in the Scryfall bulk
+        data first (if available), the remaining ones are requested in batches from the API. Only cards not found that
+        way (e.g. misspelled names) are looked up one by one using Scryfall's fuzzy search. Cards that can't be found
+        are skipped on the next builds (see get_failed_lookup).
+        """
+        uncached = [i for i in dict.fromkeys(identifiers) if not self.is_cached(*i)]
+
+        if uncached and self.cache_only:
+            raise CacheMiss(uncached)
+
+        missing = [
+            (card_set, card_name)
+            for card_set, card_name in uncached
+            if get_failed_lookup(self.settings, "mtg", card_set, card_name) is None
+        ]
+
+        if not missing:
+            return
+
+        found = {}
+        if self.bulk_index is not None:
+            for card_set, card_name in missing:
+                card_data = self.bulk_index.get(card_set, card_name)
+                if card_data is not None:
+                    found[(card_set, card_name)] = card_data
+
+        api_url = self.settings.get("MTG_SCRYFALL_API", SCRYFALL_API)
+        remaining = [i for i in missing if i not in found.keys()]
+        if remaining:
+            print(f"Fetching {len(remaining)} MTG cards from Scryfall")
+            found.update(get_collection_data(remaining, api_url=api_url))
+
+        for card_set, card_name in missing:
+            card_data = found.get((card_set, card_name))
+            if card_data is None:
+                card_data = get_card_data(card_set, card_name, api_url=api_url)
+
+            if card_data.get("object") == "error":
+                reason = card_data.get("details", "not found on Scryfall")
+                add_failed_lookup(self.settings, "mtg", card_set, card_name, reason)
+                continue
+
+            self.cached_data.set(
+                (card_set, card_name), project_card_data(card_data, self.card_fields)
+            )
+
+    def add_card_data(self, card_set, card_name):
+        self.fetch_cards_data([(card_set, card_name)])
+        if not self.is_cached(card_set, card_name):
+            return None
+
+        card_data = self.cached_data.get((card_set, card_name))
+
+        try:
+            img_url = card_data["image_uris"]["border_crop"]
+            local_path_full = get_local_card_img_path(
+                self.mtg_assets_cards_path(full=True), img_url
+            )
+            if not self.settings.get("USE_EXTERNAL_LINKS", True):
+                queue_image(img_url, local_path_full)
+        except (KeyError, ValueError, TypeError, OSError) as e:
+            print(f"an error occurred fetching {card_name} from set {card_set}: {e}")
+
+        return card_data
+
+    def parse_deck(self, filename):
+        metadata = {
+            "category": "MTG_Deck",
+            "date": get_last_modified(filename),
+            "template": "mtg_deck",
+        }
+
+        deck_data = {"main": [], "sideboard": [], "colors": []}
+        description = []
+
+        cmc_per_color = defaultdict(list)
+
+        card_lines = []
+
+        with open(filename, "r") as fin:
+            for line in fin:
+                if line.startswith("//"):
+                    tag, value = parse_meta(line)
+                    metadata[tag.lower()] = value
+                elif line.startswith("---"):
+                    # This is the description, read until end of file
+                    for dl in fin:
+                        description.append(dl.strip())
+                elif line.strip() != "":
+                    card_lines.append(parse_card_line(line))
+
+        # Resolve all cards in the deck at once, so missing cards can be fetched in batches
+        self.fetch_cards_data([(s, n) for _, s, _, n in card_lines])
+
+        for sideboard, card_set, card_count, card_name in card_lines:
+            cached_card = self.add_card_data(card_set, card_name)
+            if cached_card is None:
+                continue
+
+            card = MTGCard(
+                name=card_name,
+                data=freeze(cached_card),
+                card_type=parse_card_type(cached_card["type_line"]),
+            )
+            card_data = DeckCard(card=intern(card), count=card_count)
+
+            for color in cached_card["colors"]:
+                if color not in deck_data["colors"]:
+                    deck_data["colors"].append(color)
+
+            if sideboard:
+                deck_data["sideboard"].append(card_data)
+            else:
+                deck_data["main"].append(card_data)
+
+                if card_data.card_type != "land":
+                    card_colors = cached_card["colors"]
+                    num_colors = len(card_colors)
+                    card_cmc = min(11, int(cached_card["cmc"]))
+
+                    if num_colors == 1:
+                        cmc_per_color[card_colors[0]].extend([card_cmc] * card_count)
+                    elif num_colors == 0:
+                        # Artifact and devoid cards
+                        cmc_per_color["A"].extend([card_cmc] * card_count)
+                    else:
+                        # Multicolor and hybrid cards
+                        cmc_per_color["M"].extend([card_cmc] * card_count)
+
+        cmc_distribution = {k: dict(Counter(v)) for k, v in cmc_per_color.items()}
+        for k in cmc_distribution.keys():
+            for i in range(0, 12):
+                if i not in cmc_distribution[k].keys():
+                    cmc_distribution[k][i] = 0
+
+        deck_data["colors_string"] = "".join(
+            ["{" + str(c).upper() + "}" for c in sorted(deck_data["colors"])]
+        )
+        deck_data["cmc_distribution"] = {
+            k: [a[1] for a in sorted(v.items())] for k, v in cmc_distribution.items()
+        }
+        deck_data["cmc_distribution_colors"] = cmc_distribution_colors
+
+        deck_data["main_stacks"] = build_stacks(deck_data["main"])
+        deck_data["sideboard_stacks"] = build_stacks(deck_data["sideboard"])
+
+        print(f"Adding MTG {metadata['name']}")
+        metadata["title"] = metadata["name"]
+        metadata["slug"] = slugify(
+            metadata["title"],
+            regex_subs=self.settings.get("SLUG_REGEX_SUBSTITUTIONS", []),
+        )
+
+        metadata["description"] = "\n".join(description)
+
+        metadata["url"] = f"mtg/{metadata['format']}/{metadata['slug']}/"
+        metadata["save_as"] = f"{metadata['url']}index.html"
+
+        metadata["deck"] = deck_data
+
+        return metadata
+
+    def read(self, filename):
+        metadata = get_preparsed_deck(filename) or read_deck(self, filename)
+
+        parsed = {}
+        for key, value in metadata.items():
+            parsed[key] = self.process_metadata(key, value)
+
+        return "", parsed
+
+
+def add_reader(readers):
+    readers.reader_classes["mwDeck"] = MTGReader
+
+
+def register():
+    signals.readers_init.connect(add_reader)
+    signals.article_generator_init.connect(preparse_decks)
+    signals.article_generator_finalized.connect(download_images)
+    signals.article_generator_finalized.connect(generate_derivatives)
+    signals.finalized.connect(flush_caches)
+    signals.finalized.connect(report_failed_lookups)
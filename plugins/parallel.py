@@ -0,0 +1,130 @@
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+from plugins.cache import open_caches, open_connections
+from plugins.images import pending_images, take_pending_images
+from plugins.incremental import get_stored_deck, record_deck, store_deck
+
+# Decks parsed ahead of time by the worker pool, by absolute path of the deck file
+preparsed_decks = {}
+
+# Reader used by a worker process, per reader class
+worker_readers = {}
+
+
+class CacheMiss(Exception):
+    """Raised by readers in cache-only mode when a card would have to be fetched"""
+
+
+def get_picklable_settings(settings):
+    output = {}
+    for key, value in settings.items():
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+        output[key] = value
+
+    return output
+
+
+def init_worker():
+    # Caches inherited from the main process (when forked) may hold changes that weren't written yet, SQLite
+    # connections can't be used across a fork either, each worker opens its own
+    open_caches.clear()
+    open_connections.clear()
+    worker_readers.clear()
+    pending_images.clear()
+
+
+def parse_deck_file(reader_class, settings, filename):
+    """
+    Parse a deck file in a worker process, using only data that is cached already.
+
+    :return: tuple with the deck's metadata, the cache entries and the images it uses (see record_deck), the metadata
+             is None if the deck can't be parsed without fetching or updating cached data, the deck is then parsed by
+             Pelican's reader
+    """
+    if reader_class not in worker_readers.keys():
+        reader = reader_class(settings)
+        reader.cache_only = True
+        worker_readers[reader_class] = reader
+
+    try:
+        metadata, entries, deck_images = record_deck(
+            worker_readers[reader_class], filename
+        )
+    except CacheMiss:
+        take_pending_images()
+        return None, [], []
+
+    if any(cache.dirty for cache in open_caches.values()):
+        # Cached data changed while parsing (e.g. an entry was migrated), start over with the stored caches
+        open_caches.clear()
+        worker_readers.clear()
+        take_pending_images()
+        return None, [], []
+
+    take_pending_images()
+    return metadata, entries, deck_images
+
+
+def preparse_decks(generator):
+    """
+    Parse all deck files of the article generator in a pool of DECKLOCK_WORKERS processes (None uses all cores), the
+    readers then return these results. Parsing in parallel is skipped when DECKLOCK_WORKERS is 1 (the default). Decks
+    with an up-to-date stored result (see read_deck) are skipped as well.
+    """
+    workers = generator.settings.get("DECKLOCK_WORKERS", 1)
+    if workers == 1:
+        return
+
+    jobs = []
+    for extension, reader in generator.readers.readers.items():
+        if not hasattr(reader, "parse_deck"):
+            continue
+
+        for f in generator.get_files(
+            generator.settings["ARTICLE_PATHS"],
+            exclude=generator.settings["ARTICLE_EXCLUDES"],
+            extensions=[extension],
+        ):
+            filename = os.path.abspath(os.path.join(generator.path, f))
+            if get_stored_deck(generator.settings, reader.__class__, filename) is None:
+                jobs.append((reader.__class__, filename))
+
+    if len(jobs) < 2:
+        return
+
+    settings = get_picklable_settings(generator.settings)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as executor:
+        results = executor.map(
+            parse_deck_file,
+            [reader_class for reader_class, _ in jobs],
+            [settings] * len(jobs),
+            [filename for _, filename in jobs],
+        )
+
+        for (reader_class, filename), (metadata, entries, images) in zip(jobs, results):
+            if metadata is not None:
+                preparsed_decks[filename] = metadata
+                store_deck(
+                    generator.settings,
+                    reader_class,
+                    filename,
+                    metadata,
+                    entries,
+                    images,
+                )
+                pending_images.update(images)
+
+    print(
+        f"Parsed {len(preparsed_decks)} of {len(jobs)} decks "
+        f"using {workers or os.cpu_count()} workers"
+    )
+
+
+def get_preparsed_deck(filename):
+    return preparsed_decks.pop(os.path.abspath(filename), None)
@@ -0,0 +1,194 @@
+"""
+Immutable records for the cards in decks. A card's data is stored once, however many decks use it, each deck only
+holds entries with the card and the number of copies (DeckCard). Fields are read as attributes in the templates, items
+(card["count"]) and get() work as well, like with the dicts these records replace.
+"""
+
+# Records created during this build, equal records are shared rather than stored for every deck
+interned_records = {}
+
+# Record classes by name, used to load records stored as json or pickled. Records are defined here rather than in the
+# plugins, as the plugins' modules can be imported twice (as mtg.reader and as plugins.mtg.reader).
+record_classes = {}
+
+# Classes of the CardData records, by their fields
+data_classes = {}
+
+
+class Record:
+    """Base class of the records, subclasses list their fields in __slots__"""
+
+    __slots__ = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        record_classes.setdefault(cls.__name__, cls)
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            object.__setattr__(self, name, fields.pop(name, None))
+
+        if fields:
+            raise TypeError(
+                f"{type(self).__name__} has no fields {', '.join(fields.keys())}"
+            )
+
+    @classmethod
+    def load(cls, fields):
+        return intern(cls(**fields))
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __getitem__(self, name):
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+
+    def __contains__(self, name):
+        return hasattr(self, name)
+
+    def get(self, name, default=None):
+        return getattr(self, name, default)
+
+    def _asdict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def _key(self):
+        return tuple(get_strict_key(getattr(self, name)) for name in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash((type(self), self._key()))
+
+    def __repr__(self):
+        fields = ", ".join(f"{k}={v!r}" for k, v in self._asdict().items())
+        return f"{type(self).__name__}({fields})"
+
+    def __reduce__(self):
+        return load_record, (type(self).__name__, self._asdict())
+
+
+class CardData(Record):
+    """
+    A card's data as cached (e.g. a Scryfall card), see freeze. The fields differ between games and settings, so a
+    subclass is created for each set of fields.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def load(cls, fields):
+        return freeze(fields)
+
+
+class DeckCard(Record):
+    """A card in a deck, the fields of the card can be read from the entry directly (card.name)"""
+
+    __slots__ = ("card", "count")
+
+    def __getattr__(self, name):
+        # Only called for names that aren't fields of the entry
+        if name == "card":
+            raise AttributeError(name)
+
+        return getattr(self.card, name)
+
+
+class MTGCard(Record):
+    """An MTG card as named in the deck file, with Scryfall's data (data.name can differ, e.g. for split cards)"""
+
+    __slots__ = ("name", "data", "card_type")
+
+
+class GwentCard(Record):
+    """A Gwent card as named in the deck file, with the data from gwent.one"""
+
+    __slots__ = ("name", "data")
+
+
+def get_strict_key(value):
+    """Key telling apart values that are equal in Python but rendered differently (e.g. True, 1 and 1.0)"""
+    if isinstance(value, tuple):
+        return tuple(get_strict_key(v) for v in value)
+
+    if isinstance(value, Record):
+        return value
+
+    return type(value), value
+
+
+def intern(record):
+    """:return: the record that is shared by all decks, equal to the given one"""
+    try:
+        return interned_records.setdefault(record, record)
+    except TypeError:
+        # Records with mutable values (see freeze) can't be shared
+        return record
+
+
+def get_data_class(fields):
+    if fields not in data_classes.keys():
+        data_classes[fields] = type("CardData", (CardData,), {"__slots__": fields})
+
+    return data_classes[fields]
+
+
+def is_field_name(name):
+    return (
+        isinstance(name, str)
+        and name.isidentifier()
+        and not name.startswith("__")
+        and not hasattr(CardData, name)
+    )
+
+
+def freeze(value):
+    """
+    Immutable copy of json data: dicts become CardData records and lists tuples. Dicts with keys that can't be used as
+    field names are copied as dicts. Lists aren't kept as lists since the copy is shared by all decks using it, so the
+    templates see tuples (see README).
+
+    :param value: json data, e.g. a card's cached data
+    :return: the copy, equal records are shared
+    """
+    if isinstance(value, Record):
+        return value
+
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+
+    if isinstance(value, dict):
+        fields = tuple(value.keys())
+        if not all(is_field_name(k) for k in fields):
+            return {k: freeze(v) for k, v in value.items()}
+
+        return intern(get_data_class(fields)(**{k: freeze(value[k]) for k in fields}))
+
+    return value
+
+
+def load_record(name, fields):
+    return record_classes[name].load(fields)
+
+
+def dump_record(value):
+    """Used as default when writing json, records are written as dicts (see load_json_record)"""
+    if isinstance(value, Record):
+        return {"__record__": type(value).__name__, **value._asdict()}
+
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def load_json_record(data):
+    """Used as object_hook when reading json, see dump_record"""
+    if "__record__" in data.keys():
+        return load_record(data.pop("__record__"), data)
+
+    return data
@@ -1,19 +1,327 @@
-import os
-import requests
-from datetime import datetime
-
-
-def fetch_image(img_url, img_file_path):
-    if not os.path.exists(img_file_path):
-        print(f"Fetching image {img_url}")
-        r = requests.get(img_url, allow_redirects=True)
-        open(img_file_path, "wb").write(r.content)
-    else:
-        # print(f"Using cached image {img_file_path}")
-        pass
-
-
-def get_last_modified(path):
-    last_modification = datetime.utcfromtimestamp(os.path.getmtime(path))
-
-    return last_modification.strftime("%Y-%m-%d")
+import json
+import os
+import threading
+import time
+import requests
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+
+# Requests per second allowed for each host, hosts not listed here use DEFAULT_RATE_LIMIT
+HOST_RATE_LIMITS = {
+    "api.scryfall.com": 10,
+    "gwent.one": 10,
+    "decksofkeyforge.com": 2,
+    "www.keyforgegame.com": 2,
+}
+DEFAULT_RATE_LIMIT = 20
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class TokenBucket:
+    """Rate limiter allowing `rate` requests per second on average, with bursts of up to `capacity` requests"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+            # Reserve a token, if none is available wait until it has been refilled
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
+
+
+def get_retry_after(response, default):
+    """Seconds to wait before retrying, taken from the Retry-After header (in seconds or as a date) if present"""
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is None:
+        return default
+
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return default
+
+
+class HTTPClient:
+    """
+    Shared HTTP client for all plugins: connections are pooled and kept alive, requests are rate limited per host and
+    the number of requests in flight is bounded. Requests that fail with 429 or a 5xx status (or a connection error)
+    are retried with exponential backoff, honoring the Retry-After header.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=8,
+        retries=3,
+        backoff=1.0,
+        timeout=30,
+        rate_limits=HOST_RATE_LIMITS,
+        default_rate_limit=DEFAULT_RATE_LIMIT,
+    ):
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.rate_limits = rate_limits
+        self.default_rate_limit = default_rate_limit
+        self.semaphore = threading.BoundedSemaphore(max_concurrency)
+        self.buckets = {}
+        self.buckets_lock = threading.Lock()
+        self.unreachable_hosts = set()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=max_concurrency)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def get_bucket(self, url):
+        host = urlparse(url).hostname
+        with self.buckets_lock:
+            if host not in self.buckets.keys():
+                rate = self.rate_limits.get(host, self.default_rate_limit)
+                self.buckets[host] = TokenBucket(rate)
+
+            return self.buckets[host]
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        bucket = self.get_bucket(url)
+
+        # Don't wait for retries again for hosts that couldn't be reached at all (e.g. when building offline)
+        host = urlparse(url).hostname
+        if host in self.unreachable_hosts:
+            raise requests.ConnectionError(f"{host} could not be reached earlier")
+
+        for attempt in range(self.retries + 1):
+            delay = self.backoff * 2**attempt
+            bucket.acquire()
+
+            try:
+                with self.semaphore:
+                    response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.retries:
+                    # A slow response (read timeout) doesn't mean other requests to the host will fail as well
+                    if isinstance(e, requests.ConnectionError):
+                        self.unreachable_hosts.add(host)
+                    raise
+                print(f"Request to {url} failed, retrying in {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            if response.status_code not in RETRY_STATUS_CODES:
+                return response
+
+            if attempt == self.retries:
+                return response
+
+            delay = get_retry_after(response, delay)
+            print(f"HTTP {response.status_code} from {url}, retrying in {delay:.1f}s")
+            response.close()
+            time.sleep(delay)
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+
+http_client = HTTPClient()
+
+
+def fetch_image(img_url, img_file_path, chunk_size=1 << 16):
+    """
+    Download an image, streaming it to a temporary .part file that is renamed once the download is complete. If an
+    earlier download was interrupted, the .part file is resumed when the server supports range requests and discarded
+    otherwise.
+
+    :param img_url: url of the image
+    :param img_file_path: path to store the image at
+    :param chunk_size: number of bytes to write at once
+    :return: True if the image is available at img_file_path, False if the download failed
+    """
+    if os.path.exists(img_file_path):
+        return True
+
+    print(f"Fetching image {img_url}")
+    part_path = f"{img_file_path}.part"
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset > 0 else {}
+
+    try:
+        with http_client.get(
+            img_url, headers=headers, allow_redirects=True, stream=True
+        ) as r:
+            if r.status_code == 416 and offset > 0:
+                # The partial file doesn't match the image (anymore), start over
+                os.remove(part_path)
+                return fetch_image(img_url, img_file_path, chunk_size)
+
+            if r.status_code == 206 and get_range_start(r) != offset:
+                if offset == 0:
+                    print(f"Warning: failed to fetch image {img_url}: unexpected range")
+                    return False
+
+                # The server sent another part of the image than requested, start over
+                os.remove(part_path)
+                return fetch_image(img_url, img_file_path, chunk_size)
+
+            if r.status_code not in (200, 206):
+                print(f"Warning: failed to fetch image {img_url}: HTTP {r.status_code}")
+                return False
+
+            # A full response (200) means the server ignored the range, overwrite the partial file
+            mode = "ab" if r.status_code == 206 else "wb"
+            expected = r.headers.get("Content-Length")
+
+            with open(part_path, mode) as fout:
+                for chunk in r.iter_content(chunk_size=chunk_size):
+                    fout.write(chunk)
+
+            # Content-Length is the size of the body as sent (e.g. gzip encoded), not of the decoded chunks
+            received = r.raw.tell()
+    except requests.RequestException as e:
+        print(f"Warning: failed to fetch image {img_url}: {e}")
+        return False
+
+    if expected is not None and received != int(expected):
+        print(f"Warning: incomplete image {img_url}: {received} of {expected} bytes")
+        return False
+
+    os.replace(part_path, img_file_path)
+    return True
+
+
+def get_range_start(response):
+    """:return: first byte of a partial (206) response, from its Content-Range header (bytes 100-199/200)"""
+    content_range = response.headers.get("Content-Range", "")
+    unit, _, byte_range = content_range.partition(" ")
+    try:
+        return int(byte_range.split("-")[0]) if unit == "bytes" else None
+    except ValueError:
+        return None
+
+
+def iter_json_array(path, chunk_size=1 << 20):
+    """
+    Stream the values from a json file with a large array (e.g. Scryfall's bulk data or the FaB card database) one at
+    a time, without loading the entire array in memory.
+
+    :param path: path to the json file
+    :param chunk_size: number of characters to read from the file at once
+    :return: generator yielding one value at a time
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    eof = False
+    started = False
+
+    with open(path, "r", encoding="utf-8") as fin:
+        while True:
+            pos = 0
+            while True:
+                # Skip the opening bracket, separators and whitespace in between values
+                while pos < len(buffer) and (
+                    buffer[pos] in ",\r\n\t " or (buffer[pos] == "[" and not started)
+                ):
+                    started = started or buffer[pos] == "["
+                    pos += 1
+
+                if pos == len(buffer):
+                    break
+
+                if buffer[pos] == "]":
+                    return
+
+                try:
+                    item, end = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    # Value is incomplete, read the next chunk
+                    break
+
+                if not eof and (end == len(buffer) or buffer[end] not in "],\r\n\t "):
+                    # A number can continue in the next chunk (e.g. 12 of 12345 or 1 of 1.5), read it first
+                    break
+
+                yield item
+                pos = end
+
+            buffer = buffer[pos:]
+
+            if eof:
+                return
+
+            chunk = fin.read(chunk_size)
+            if not chunk:
+                eof = True
+            buffer += chunk
+
+
+def project_fields(data, fields):
+    """
+    Keep only the requested fields of a (nested) dict, nested fields are selected using dots (e.g. "image_uris.small")
+
+    :param data: dict to select fields from
+    :param fields: list of fields to keep
+    :return: new dict with only the requested fields that were present in data
+    """
+    output = {}
+
+    for field in fields:
+        parts = field.split(".")
+        value = data
+        for part in parts:
+            if not isinstance(value, dict) or part not in value.keys():
+                break
+            value = value[part]
+        else:
+            node = output
+            for part in parts[:-1]:
+                node = node.setdefault(part, {})
+            node[parts[-1]] = value
+
+    return output
+
+
+def write_json(data, path):
+    """
+    Write data to a json file atomically: the data is written to a temporary file first which then replaces the
+    original, so an interrupted build never leaves a truncated cache behind.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "w") as fout:
+            json.dump(data, fout, sort_keys=True, indent=4, separators=(",", ": "))
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_last_modified(path):
+    last_modification = datetime.utcfromtimestamp(os.path.getmtime(path))
+
+    return last_modification.strftime("%Y-%m-%d")
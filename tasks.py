@@ -1,131 +1,173 @@
-# -*- coding: utf-8 -*-
-
-import os
-import shutil
-import sys
-import datetime
-
-from invoke import task
-from pelican.server import ComplexHTTPRequestHandler, RootedHTTPServer
-from pelican.settings import DEFAULT_CONFIG, get_settings_from_file
-
-SETTINGS_FILE_BASE = "pelicanconf.py"
-SETTINGS = {}
-SETTINGS.update(DEFAULT_CONFIG)
-LOCAL_SETTINGS = get_settings_from_file(SETTINGS_FILE_BASE)
-SETTINGS.update(LOCAL_SETTINGS)
-
-CONFIG = {
-    "settings_base": SETTINGS_FILE_BASE,
-    "settings_publish": "publishconf.py",
-    # Output path. Can be absolute or relative to tasks.py. Default: 'output'
-    "deploy_path": SETTINGS["OUTPUT_PATH"],
-    # Github Pages configuration
-    "github_pages_branch": "gh-pages",
-    "commit_message": "'Publish site on {}'".format(datetime.date.today().isoformat()),
-    # Port for `serve`
-    "port": 8000,
-}
-
-
-@task
-def clean(c):
-    """Remove generated files"""
-    if os.path.isdir(CONFIG["deploy_path"]):
-        shutil.rmtree(CONFIG["deploy_path"])
-        os.makedirs(CONFIG["deploy_path"])
-
-
-@task
-def build(c):
-    """Build local version of site"""
-    c.run("pelican -s {settings_base}".format(**CONFIG))
-
-
-@task
-def rebuild(c):
-    """`build` with the delete switch"""
-    c.run("pelican -d -s {settings_base}".format(**CONFIG))
-
-
-@task
-def regenerate(c):
-    """Automatically regenerate site upon file modification"""
-    c.run("pelican -r -s {settings_base}".format(**CONFIG))
-
-
-@task
-def serve(c):
-    """Serve site at http://localhost:$PORT/ (default port is 8000)"""
-
-    class AddressReuseTCPServer(RootedHTTPServer):
-        allow_reuse_address = True
-
-    server = AddressReuseTCPServer(
-        CONFIG["deploy_path"], ("", CONFIG["port"]), ComplexHTTPRequestHandler
-    )
-
-    sys.stderr.write("Serving on port {port} ...\n".format(**CONFIG))
-    server.serve_forever()
-
-
-@task
-def reserve(c):
-    """`build`, then `serve`"""
-    build(c)
-    serve(c)
-
-
-@task
-def preview(c):
-    """Build production version of site"""
-    c.run("pelican -s {settings_publish}".format(**CONFIG))
-
-
-@task
-def livereload(c):
-    """Automatically reload browser tab upon file modification."""
-    from livereload import Server
-
-    build(c)
-    server = Server()
-    # Watch the base settings file
-    server.watch(CONFIG["settings_base"], lambda: build(c))
-    # Watch content source files
-    content_file_extensions = [".md", ".rst"]
-    for extension in content_file_extensions:
-        content_blob = "{0}/**/*{1}".format(SETTINGS["PATH"], extension)
-        server.watch(content_blob, lambda: build(c))
-    # Watch the theme's templates and static static
-    theme_path = SETTINGS["THEME"]
-    server.watch("{}/templates/*.html".format(theme_path), lambda: build(c))
-    static_file_extensions = [".css", ".js"]
-    for extension in static_file_extensions:
-        static_file = "{0}/static/**/*{1}".format(theme_path, extension)
-        server.watch(static_file, lambda: build(c))
-    # Serve output path on configured port
-    server.serve(port=CONFIG["port"], root=CONFIG["deploy_path"])
-
-
-@task
-def publish(c):
-    """Publish to production via rsync"""
-    c.run("pelican -s {settings_publish}".format(**CONFIG))
-    c.run(
-        'rsync --delete --exclude ".DS_Store" -pthrvz -c '
-        '-e "ssh -p {ssh_port}" '
-        "{} {ssh_user}@{ssh_host}:{ssh_path}".format(
-            CONFIG["deploy_path"].rstrip("/") + "/", **CONFIG
-        )
-    )
-
-
-@task
-def gh_pages(c):
-    """Publish to GitHub Pages"""
-    preview(c)
-    c.run(
-        "ghp-import -b {github_pages_branch} "
-        "-m {commit_message} "
-        "{deploy_path} -p".format(**CONFIG)
-    )
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import sys
+import datetime
+
+from invoke import task
+from pelican.server import ComplexHTTPRequestHandler, RootedHTTPServer
+from pelican.settings import DEFAULT_CONFIG, get_settings_from_file
+
+SETTINGS_FILE_BASE = "pelicanconf.py"
+SETTINGS = {}
+SETTINGS.update(DEFAULT_CONFIG)
+LOCAL_SETTINGS = get_settings_from_file(SETTINGS_FILE_BASE)
+SETTINGS.update(LOCAL_SETTINGS)
+
+CONFIG = {
+    "settings_base": SETTINGS_FILE_BASE,
+    "settings_publish": "publishconf.py",
+    # Output path. Can be absolute or relative to tasks.py. Default: 'output'
+    "deploy_path": SETTINGS["OUTPUT_PATH"],
+    # Github Pages configuration
+    "github_pages_branch": "gh-pages",
+    "commit_message": "'Publish site on {}'".format(datetime.date.today().isoformat()),
+    # Port for `serve`
+    "port": 8000,
+}
+
+
+@task
+def clean(c):
+    """Remove generated files"""
+    if os.path.isdir(CONFIG["deploy_path"]):
+        shutil.rmtree(CONFIG["deploy_path"])
+        os.makedirs(CONFIG["deploy_path"])
+
+
+@task
+def build(c):
+    """Build local version of site"""
+    c.run("pelican -s {settings_base}".format(**CONFIG))
+
+
+@task
+def rebuild(c):
+    """`build` with the delete switch"""
+    c.run("pelican -d -s {settings_base}".format(**CONFIG))
+
+
+@task
+def regenerate(c):
+    """Automatically regenerate site upon file modification"""
+    c.run("pelican -r -s {settings_base}".format(**CONFIG))
+
+
+@task
+def serve(c):
+    """Serve site at http://localhost:$PORT/ (default port is 8000)"""
+
+    class AddressReuseTCPServer(RootedHTTPServer):
+        allow_reuse_address = True
+
+    server = AddressReuseTCPServer(
+        CONFIG["deploy_path"], ("", CONFIG["port"]), ComplexHTTPRequestHandler
+    )
+
+    sys.stderr.write("Serving on port {port} ...\n".format(**CONFIG))
+    server.serve_forever()
+
+
+@task
+def reserve(c):
+    """`build`, then `serve`"""
+    build(c)
+    serve(c)
+
+
+@task
+def preview(c):
+    """Build production version of site"""
+    c.run("pelican -s {settings_publish}".format(**CONFIG))
+
+
+@task
+def livereload(c):
+    """Automatically reload browser tab upon file modification."""
+    from livereload import Server
+
+    build(c)
+    server = Server()
+    # Watch the base settings file
+    server.watch(CONFIG["settings_base"], lambda: build(c))
+    # Watch content source files
+    content_file_extensions = [".md", ".rst"]
+    for extension in content_file_extensions:
+        content_blob = "{0}/**/*{1}".format(SETTINGS["PATH"], extension)
+        server.watch(content_blob, lambda: build(c))
+    # Watch the theme's templates and static static
+    theme_path = SETTINGS["THEME"]
+    server.watch("{}/templates/*.html".format(theme_path), lambda: build(c))
+    static_file_extensions = [".css", ".js"]
+    for extension in static_file_extensions:
+        static_file = "{0}/static/**/*{1}".format(theme_path, extension)
+        server.watch(static_file, lambda: build(c))
+    # Serve output path on configured port
+    server.serve(port=CONFIG["port"], root=CONFIG["deploy_path"])
+
+
+@task
+def benchmark_gwent(c, responses=""):
+    """Benchmark the parser for gwent.one's search results, on saved responses (comma separated) or the cached cards"""
+    from plugins.gwent.benchmark import main
+
+    main(
+        [p for p in responses.split(",") if p],
+        os.path.join(
+            SETTINGS["PATH"], SETTINGS["DECKLOCK_CACHE"], "gwent.cached_cards.json"
+        ),
+    )
+
+
+@task
+def precompile_templates(c):
+    """Compile the theme's templates into the template cache, so builds (with DECKLOCK_TEMPLATE_CACHE) skip compiling"""
+    from pelican import Pelican
+    from pelican.generators import Generator
+    from pelican.settings import read_settings
+
+    from plugins.jinja_cache.jinja_cache import (
+        get_template_cache_path,
+        precompile_templates,
+    )
+
+    settings = read_settings(
+        CONFIG["settings_base"], override={"DECKLOCK_TEMPLATE_CACHE": True}
+    )
+
+    # Loads the plugins, the filters and extensions they add are needed to compile the templates
+    Pelican(settings)
+    generator = Generator(
+        {}, settings, settings["PATH"], settings["THEME"], settings["OUTPUT_PATH"]
+    )
+
+    count = precompile_templates(generator.env)
+    print(f"Compiled {count} templates to {get_template_cache_path(settings)}")
+
+    if not LOCAL_SETTINGS.get("DECKLOCK_TEMPLATE_CACHE", False):
+        print("Set DECKLOCK_TEMPLATE_CACHE = True in pelicanconf.py to use them")
+
+
+@task
+def publish(c):
+    """Publish to production via rsync"""
+    c.run("pelican -s {settings_publish}".format(**CONFIG))
+    c.run(
+        'rsync --delete --exclude ".DS_Store" -pthrvz -c '
+        '-e "ssh -p {ssh_port}" '
+        "{} {ssh_user}@{ssh_host}:{ssh_path}".format(
+            CONFIG["deploy_path"].rstrip("/") + "/", **CONFIG
+        )
+    )
+
+
+@task
+def gh_pages(c):
+    """Publish to GitHub Pages"""
+    preview(c)
+    c.run(
+        "ghp-import -b {github_pages_branch} "
+        "-m {commit_message} "
+        "{deploy_path} -p".format(**CONFIG)
+    )
@@ -0,0 +1,70 @@
+import os
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from plugins import failed_lookups, images, parallel
+from plugins.cache import open_caches, open_connections
+from plugins.fab.reader import card_databases
+from plugins.utils import http_client
+
+FIXTURES_PATH = os.path.join(os.path.dirname(__file__), "fixtures")
+
+
+@pytest.fixture
+def settings(tmp_path):
+    """Settings of a build with an empty content folder, the state kept between builds is cleared afterwards"""
+    yield {
+        "PATH": str(tmp_path),
+        "DECKLOCK_CACHE": "cache",
+        "USE_EXTERNAL_LINKS": True,
+        "MTG_ASSETS_PATH": "assets/mtg",
+        "GWENT_ASSETS_PATH": "assets/gwent",
+        "FAB_ASSETS_PATH": "assets/fab",
+    }
+
+    for connection in open_connections.values():
+        connection.close()
+
+    open_caches.clear()
+    open_connections.clear()
+    failed_lookups.failed_lookups.clear()
+    card_databases.clear()
+    images.pending_images.clear()
+    parallel.preparsed_decks.clear()
+    http_client.unreachable_hosts.clear()
+
+
+@pytest.fixture
+def local_server():
+    """Start a local HTTP server with a request handler class, returns the server's url"""
+    servers = []
+
+    def start(handler):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}"
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def no_network(monkeypatch):
+    """Fail the test on any request made through the shared HTTP client"""
+
+    def request(method, url, **kwargs):
+        raise AssertionError(f"Unexpected request: {method} {url}")
+
+    monkeypatch.setattr(http_client.session, "request", request)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    """Retry failed requests without waiting"""
+    monkeypatch.setattr(http_client, "backoff", 0)
@@ -0,0 +1,74 @@
+from types import SimpleNamespace
+
+import pytest
+
+from plugins.cache import open_caches, open_cache
+from plugins.jinja_filters.jinja_filters import (
+    get_markdown_filter,
+    markdown_filters,
+    prune_markdown_cache,
+)
+
+
+def reopen_cache(settings, name):
+    open_caches.clear()
+    return open_cache(settings, name)
+
+
+@pytest.fixture(params=["json", "sqlite"])
+def backend_settings(request, settings):
+    settings["DECKLOCK_CACHE_BACKEND"] = request.param
+    return settings
+
+
+def test_delete(backend_settings):
+    cache = open_cache(backend_settings, "mtg")
+    cache.set(("m11", "Lightning Bolt"), {"name": "Lightning Bolt"})
+    cache.set(("xln", "Opt"), {"name": "Opt"})
+    cache.flush()
+
+    cache.delete(("xln", "Opt"))
+    cache.delete(("dom", "Opt"))
+    assert cache.get(("xln", "Opt")) is None
+    assert cache.keys() == [("m11", "Lightning Bolt")]
+    assert [k for k, _ in cache.items()] == [("m11", "Lightning Bolt")]
+    cache.flush()
+
+    cache = reopen_cache(backend_settings, "mtg")
+    assert cache.keys() == [("m11", "Lightning Bolt")]
+    assert cache.get(("xln", "Opt")) is None
+
+
+def test_set_after_delete(backend_settings):
+    cache = open_cache(backend_settings, "mtg")
+    cache.set(("xln", "Opt"), {"name": "Opt"})
+    cache.flush()
+
+    cache.delete(("xln", "Opt"))
+    cache.set(("xln", "Opt"), {"name": "Opt", "set": "xln"})
+    cache.flush()
+
+    cache = reopen_cache(backend_settings, "mtg")
+    assert cache.get(("xln", "Opt")) == {"name": "Opt", "set": "xln"}
+
+
+def test_unused_markdown_is_pruned(backend_settings):
+    pelican = SimpleNamespace(settings=backend_settings)
+    md = get_markdown_filter(backend_settings)
+    try:
+        md("Old *description*")
+        md("Welcome")
+        prune_markdown_cache(pelican)
+        assert len(reopen_cache(backend_settings, "markdown").keys()) == 2
+
+        # Next build: the description was edited
+        md("New *description*")
+        md("Welcome")
+        prune_markdown_cache(pelican)
+        cache = reopen_cache(backend_settings, "markdown")
+
+        assert cache.keys() == sorted(
+            [md.get_key("New *description*"), md.get_key("Welcome")]
+        )
+    finally:
+        markdown_filters.clear()
@@ -0,0 +1,154 @@
+import json
+import os
+import socket
+from http.server import BaseHTTPRequestHandler
+
+import pytest
+import requests
+
+from plugins.fab.reader import FABCardDatabase, FaBReader
+
+
+def make_card(name, pitch="", types=("Action",)):
+    return {
+        "name": name,
+        "pitch": pitch,
+        "cost": "1",
+        "power": "3",
+        "defense": "2",
+        "types": list(types),
+        "functional_text": "",
+        "type_text": " ".join(types),
+        "printings": [
+            {"image_url": f"https://img.example/{name}-{pitch}-old.png"},
+            {"image_url": f"https://img.example/{name}-{pitch}.png"},
+        ],
+    }
+
+
+def make_database_handler(server_state):
+    """
+    Stand-in for the static server hosting card.json, supporting conditional requests with ETag
+
+    :param server_state: dict with the cards and etag served, and the status of each request made
+    :return: handler class
+    """
+
+    class DatabaseHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.headers.get("If-None-Match") == server_state["etag"]:
+                server_state["requests"].append(304)
+                self.send_response(304)
+                self.end_headers()
+                return
+
+            server_state["requests"].append(200)
+            body = json.dumps(server_state["cards"]).encode("utf-8")
+            self.send_response(200)
+            self.send_header("ETag", server_state["etag"])
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return DatabaseHandler
+
+
+@pytest.fixture
+def server_state():
+    return {
+        "cards": [make_card("Snatch", "1"), make_card("Snatch", "3")],
+        "etag": '"v1"',
+        "requests": [],
+    }
+
+
+def get_database(tmp_path, url, refresh_days=0):
+    return FABCardDatabase(
+        os.path.join(tmp_path, "fab.card_database.json"),
+        f"{url}/card.json",
+        refresh_days,
+    )
+
+
+def get_compiled_files(tmp_path):
+    return sorted(f for f in os.listdir(tmp_path) if f.endswith(".cards"))
+
+
+def test_unchanged_database_is_not_compiled_again(
+    tmp_path, local_server, server_state, capsys
+):
+    url = local_server(make_database_handler(server_state))
+
+    database = get_database(tmp_path, url)
+    assert database.get_card("Snatch (blue)")["pitch"] == "3"
+    compiled = get_compiled_files(tmp_path)
+    assert "Compiling" in capsys.readouterr().out
+
+    database = get_database(tmp_path, url)
+    assert database.get_card("Snatch (red)")["pitch"] == "1"
+
+    output = capsys.readouterr().out
+    assert "up to date" in output and "Compiling" not in output
+    assert server_state["requests"] == [200, 304]
+    assert get_compiled_files(tmp_path) == compiled
+
+
+def test_changed_database_is_compiled_again(
+    tmp_path, local_server, server_state, capsys
+):
+    url = local_server(make_database_handler(server_state))
+
+    database = get_database(tmp_path, url)
+    assert database.get_card("Pummel") is None
+    compiled = get_compiled_files(tmp_path)
+
+    server_state["cards"].append(make_card("Pummel", "1"))
+    server_state["etag"] = '"v2"'
+
+    database = get_database(tmp_path, url)
+    assert database.get_card("Pummel (red)")["name"] == "Pummel"
+
+    assert capsys.readouterr().out.count("Compiling") == 2
+    assert server_state["requests"] == [200, 200]
+    assert len(get_compiled_files(tmp_path)) == 1
+    assert get_compiled_files(tmp_path) != compiled
+
+
+def test_database_is_not_checked_before_refresh_days(
+    tmp_path, local_server, server_state
+):
+    url = local_server(make_database_handler(server_state))
+
+    get_database(tmp_path, url, refresh_days=7).load_cards()
+    get_database(tmp_path, url, refresh_days=7).load_cards()
+
+    assert server_state["requests"] == [200]
+
+
+def test_download_is_tried_once_without_a_database(settings, monkeypatch):
+    # A port nothing listens on, like a build without network access
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    settings["FAB_CARD_DATABASE_URL"] = f"http://127.0.0.1:{port}/card.json"
+    reader = FaBReader(settings)
+
+    downloads = []
+    download = reader.card_db.download
+
+    def count_download():
+        downloads.append(True)
+        return download()
+
+    monkeypatch.setattr(reader.card_db, "download", count_download)
+
+    for card_name in ["Snatch (red)", "Pummel (red)", "Sink Below (blue)"]:
+        reader.add_card_data(card_name)
+        with pytest.raises(requests.ConnectionError):
+            reader.card_db.load_cards()
+
+    assert len(downloads) == 1
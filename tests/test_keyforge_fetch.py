@@ -0,0 +1,172 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from types import SimpleNamespace
+
+import pytest
+
+from plugins.cache import JSONCache, open_cache
+from plugins.keyforge.keyforge import fetch_decks_data, get_keyforge_external_data
+
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+DECK_IDS = [f"deck-{i}" for i in range(10)]
+
+# Fetch the decks in a separate process, so it can be killed like an interrupted build
+FETCH_SCRIPT = """
+import json, sys
+from plugins.cache import open_cache
+from plugins.keyforge.keyforge import fetch_decks_data
+
+settings = json.loads(sys.argv[1])
+fetch_decks_data(settings, open_cache(settings, "keyforge"), json.loads(sys.argv[2]))
+"""
+
+
+def make_vault_deck(deck_id):
+    card_id = f"card-{deck_id}"
+    return {
+        "data": {"id": deck_id, "name": deck_id, "_links": {"cards": [card_id]}},
+        "_linked": {
+            "cards": [
+                {"id": card_id, "front_image": f"https://img.example/{card_id}.png"}
+            ],
+            "houses": [
+                {"id": "Dis", "name": "Dis", "image": "https://img.example/Dis.png"}
+            ],
+        },
+    }
+
+
+def make_keyforge_handler(on_vault_request=None):
+    """
+    Stand-in for the Vault (/vault/decks/<id>/) and DoK (/dok/v3/decks/<id>, /dok/v1/stats) APIs
+
+    :param on_vault_request: called with the deck id before each Vault response
+    :return: handler class and a dict with the deck ids requested from each API
+    """
+    log = {"vault": [], "dok": []}
+
+    class KeyForgeHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            parts = self.path.split("?")[0].strip("/").split("/")
+            if parts[0] == "vault":
+                log["vault"].append(parts[2])
+                if on_vault_request is not None:
+                    on_vault_request(parts[2])
+                data = make_vault_deck(parts[2])
+            elif parts[:2] == ["dok", "v1"]:
+                data = {"expectedAmberStats": {"percentileForValue": {"15": 20}}}
+            else:
+                log["dok"].append(parts[3])
+                data = {"deck": {"expectedAmber": 15}, "sasVersion": 1}
+
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return KeyForgeHandler, log
+
+
+def get_fetch_settings(settings, url):
+    settings.update(
+        {
+            "DOK_API_KEY": "test",
+            "KEYFORGE_DOK_API": f"{url}/dok",
+            "KEYFORGE_VAULT_API": f"{url}/vault",
+            "KEYFORGE_FETCH_WORKERS": 1,
+            "KEYFORGE_CHECKPOINT": 2,
+            "KEYFORGE_PATH": "data",
+            "KEYFORGE_ASSETS_PATH": "assets/keyforge",
+        }
+    )
+    return settings
+
+
+def get_cached_deck_ids(settings):
+    cache = JSONCache(
+        os.path.join(settings["PATH"], "cache", "keyforge.cache.json"), ("deck_id",)
+    )
+    return [key[0] for key, _ in cache.items()]
+
+
+def wait_for(condition, timeout=10):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "Timed out"
+        time.sleep(0.05)
+
+
+def test_killed_fetch_resumes_from_checkpoint(settings, local_server):
+    release = threading.Event()
+
+    def block_deck(deck_id):
+        if deck_id == "deck-5":
+            release.wait(10)
+
+    handler, log = make_keyforge_handler(block_deck)
+    settings = get_fetch_settings(settings, local_server(handler))
+
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-c",
+            FETCH_SCRIPT,
+            json.dumps(settings),
+            json.dumps(DECK_IDS),
+        ],
+        cwd=REPOSITORY_PATH,
+        stdout=subprocess.DEVNULL,
+    )
+    try:
+        # Decks 0-3 are checkpointed, deck 4 is fetched but not written yet when the build is killed
+        wait_for(lambda: "deck-5" in log["vault"])
+        wait_for(lambda: len(get_cached_deck_ids(settings)) == 4)
+    finally:
+        process.kill()
+        process.wait()
+        release.set()
+
+    checkpointed = get_cached_deck_ids(settings)
+    assert checkpointed == DECK_IDS[:4]
+
+    os.makedirs(os.path.join(settings["PATH"], "data"))
+    with open(os.path.join(settings["PATH"], "data", "keyforge.json"), "w") as fout:
+        json.dump([{"deck_id": deck_id} for deck_id in DECK_IDS], fout)
+
+    log["vault"].clear()
+    log["dok"].clear()
+    get_keyforge_external_data(SimpleNamespace(settings=settings))
+
+    assert sorted(log["vault"]) == DECK_IDS[4:]
+    assert sorted(log["dok"]) == DECK_IDS[4:]
+    assert settings["KEYFORGE_DECK_COUNT"] == 10
+
+
+def test_interrupted_fetch_saves_decks_and_cancels_requests(settings, local_server):
+    def interrupt(deck_id):
+        if deck_id == "deck-5":
+            # Ctrl-C while the request for deck 5 is running, after decks 0-4 were fetched
+            time.sleep(0.2)
+            signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+
+    handler, log = make_keyforge_handler(interrupt)
+    settings = get_fetch_settings(settings, local_server(handler))
+    settings["KEYFORGE_CHECKPOINT"] = 100
+
+    with pytest.raises(KeyboardInterrupt):
+        fetch_decks_data(settings, open_cache(settings, "keyforge"), DECK_IDS)
+
+    assert log["vault"] == DECK_IDS[:6]
+    assert get_cached_deck_ids(settings) == DECK_IDS[:5]
@@ -0,0 +1,88 @@
+import json
+import os
+import posixpath
+import shutil
+
+import pytest
+
+from plugins.mtg.bulk import ScryfallBulkIndex
+from plugins.mtg.reader import MTGReader
+from tests.conftest import FIXTURES_PATH
+
+
+@pytest.fixture
+def bulk_path(tmp_path):
+    path = os.path.join(tmp_path, "default-cards.json")
+    shutil.copyfile(os.path.join(FIXTURES_PATH, "scryfall_bulk.json"), path)
+    return path
+
+
+@pytest.fixture
+def bulk_index(tmp_path, bulk_path):
+    return ScryfallBulkIndex(bulk_path, os.path.join(tmp_path, "bulk.sqlite"))
+
+
+def test_get_by_set_and_name(bulk_index):
+    assert bulk_index.get("XLN", "opt")["id"].endswith("0001")
+    assert bulk_index.get("dom", "Opt")["id"].endswith("0002")
+
+
+def test_get_without_set_returns_newest_printing(bulk_index):
+    assert bulk_index.get("", "Opt")["set"] == "dom"
+    assert bulk_index.get(None, "Opt")["set"] == "dom"
+
+
+def test_get_from_set_without_the_card(bulk_index):
+    # Like the API, another set's printing isn't used
+    assert bulk_index.get("m19", "Opt") is None
+    assert bulk_index.get("", "Counterspell") is None
+
+
+def test_get_double_faced_card(bulk_index):
+    full_name = "Delver of Secrets // Insectile Aberration"
+    for name in [full_name, "Delver of Secrets", "Insectile Aberration"]:
+        assert bulk_index.get("isd", name)["name"] == full_name
+
+
+def test_non_english_printings_are_skipped(bulk_index):
+    assert bulk_index.get("2x2", "Lightning Bolt") is None
+    assert bulk_index.get("", "Lightning Bolt")["set"] == "m11"
+
+
+def test_index_is_rebuilt_when_the_bulk_data_changes(bulk_index, bulk_path, capsys):
+    bulk_index.open()
+    assert "Indexed 4 cards" in capsys.readouterr().out
+
+    reopened = ScryfallBulkIndex(bulk_path, bulk_index.index_path)
+    assert reopened.get("m19", "Opt") is None
+    assert "Indexing" not in capsys.readouterr().out
+
+    with open(bulk_path, "r") as fin:
+        cards = json.load(fin)
+    cards.append(dict(cards[0], id="m19-opt", set="m19", released_at="2018-07-13"))
+    with open(bulk_path, "w") as fout:
+        json.dump(cards, fout)
+
+    updated = ScryfallBulkIndex(bulk_path, bulk_index.index_path)
+    assert updated.get("m19", "Opt")["id"] == "m19-opt"
+    assert "Indexed 5 cards" in capsys.readouterr().out
+
+
+def test_add_card_data_from_bulk_data(settings, bulk_path, no_network):
+    settings["MTG_SCRYFALL_BULK_DATA"] = os.path.relpath(bulk_path, settings["PATH"])
+    reader = MTGReader(settings)
+
+    card = reader.add_card_data("XLN", "Opt")
+    assert card["set"] == "xln"
+    assert card["image_uris"]["border_crop"].endswith("opt-xln.jpg")
+    assert "id" not in card
+
+    # The front face of a double faced card is used
+    card = reader.add_card_data("ISD", "Delver of Secrets")
+    assert card["type_line"] == "Creature — Human Wizard"
+    assert card["image_uris"]["border_crop"].endswith("front/0/b/delver-isd.jpg")
+
+    assert reader.cached_data.get(("ISD", "Delver of Secrets")) == card
+    assert os.path.exists(
+        posixpath.join(settings["PATH"], "cache", "mtg.scryfall_bulk.sqlite")
+    )
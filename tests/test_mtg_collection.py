@@ -0,0 +1,119 @@
+import json
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+from plugins.failed_lookups import get_failed_lookup
+from plugins.mtg.reader import MTGReader
+
+
+def make_card(name, card_set="tst"):
+    return {
+        "object": "card",
+        "name": name,
+        "set": card_set,
+        "type_line": "Instant",
+        "mana_cost": "{U}",
+        "cmc": 1.0,
+        "colors": ["U"],
+        "oracle_text": "Draw a card.",
+        "image_uris": {"border_crop": f"https://img.example/{card_set}/{name}.jpg"},
+    }
+
+
+def make_scryfall_handler(cards, fuzzy_names, collection_status=200):
+    """
+    Stand-in for the Scryfall API's /cards/collection and /cards/named endpoints
+
+    :param cards: dict with the card objects by lower case name
+    :param fuzzy_names: dict with the card name /cards/named finds for other (misspelled) names
+    :param collection_status: status of all /cards/collection responses
+    :return: handler class and a dict with the requests made
+    """
+    log = {"batches": [], "named": []}
+
+    class ScryfallHandler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status, data):
+            body = json.dumps(data).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers["Content-Length"])
+            identifiers = json.loads(self.rfile.read(length))["identifiers"]
+            log["batches"].append(identifiers)
+
+            if collection_status != 200:
+                self.send_json(collection_status, {"object": "error"})
+                return
+
+            data, not_found = [], []
+            for identifier in identifiers:
+                card = cards.get(identifier["name"].lower())
+                if card is None:
+                    not_found.append(identifier)
+                elif card not in data:
+                    data.append(card)
+
+            self.send_json(200, {"data": data, "not_found": not_found})
+
+        def do_GET(self):
+            name = parse_qs(urlparse(self.path).query)["fuzzy"][0]
+            log["named"].append(name)
+
+            card = cards.get(fuzzy_names.get(name, name).lower())
+            if card is None:
+                self.send_json(404, {"object": "error", "details": "Not found"})
+            else:
+                self.send_json(200, card)
+
+    return ScryfallHandler, log
+
+
+def get_reader(settings, api_url):
+    settings["MTG_SCRYFALL_API"] = api_url
+    return MTGReader(settings)
+
+
+def test_cards_are_requested_in_batches(settings, local_server):
+    cards = {f"card {i}": make_card(f"Card {i}") for i in range(80)}
+    handler, log = make_scryfall_handler(cards, {})
+    reader = get_reader(settings, local_server(handler))
+
+    reader.fetch_cards_data([("TST", f"Card {i}") for i in range(80)])
+
+    assert [len(b) for b in log["batches"]] == [75, 5]
+    assert log["batches"][0][0] == {"name": "Card 0", "set": "TST"}
+    assert log["named"] == []
+    assert reader.cached_data.get(("TST", "Card 79"))["name"] == "Card 79"
+
+
+def test_cards_not_found_use_the_fuzzy_search(settings, local_server):
+    cards = {"opt": make_card("Opt"), "lightning bolt": make_card("Lightning Bolt")}
+    handler, log = make_scryfall_handler(cards, {"Lightnig Bolt": "Lightning Bolt"})
+    reader = get_reader(settings, local_server(handler))
+
+    reader.fetch_cards_data([("", "Opt"), ("", "Lightnig Bolt"), ("", "Missing")])
+
+    assert len(log["batches"]) == 1
+    assert log["named"] == ["Lightnig Bolt", "Missing"]
+    assert reader.cached_data.get(("", "Lightnig Bolt"))["name"] == "Lightning Bolt"
+    assert reader.cached_data.get(("", "Missing")) is None
+    assert get_failed_lookup(settings, "mtg", "", "Missing") == "Not found"
+
+
+def test_failed_batch_falls_back_to_single_lookups(settings, local_server, capsys):
+    cards = {"opt": make_card("Opt"), "lightning bolt": make_card("Lightning Bolt")}
+    handler, log = make_scryfall_handler(cards, {}, collection_status=503)
+    reader = get_reader(settings, local_server(handler))
+
+    reader.fetch_cards_data([("", "Opt"), ("", "Lightning Bolt")])
+
+    assert "collection request failed: HTTP 503" in capsys.readouterr().out
+    assert log["named"] == ["Opt", "Lightning Bolt"]
+    assert reader.is_cached("", "Opt") and reader.is_cached("", "Lightning Bolt")